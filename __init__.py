@@ -26,6 +26,7 @@ if not os.path.isfile(
         "API_KEY": "u api key",
         "API_URL": "http://api.openai.com/v1/chat/completions",
         "AVAILABLE_MODELS": ["gpt-4o", "gpt-4o-mini"],
+        "RATE_LIMITS": {"RPM": None, "TPM": None},
     }
     with open(
         os.path.join(os.path.dirname(os.path.realpath(__file__)), "config.json"), "w"
@@ -3,8 +3,10 @@ import re
 from tqdm import tqdm
 import threading
 from core.model import APIModel
+from core.scheduler import new_job_id
 from utils.utils import tokenCounter
 from config.prompt import CRITERIA_BASED_JUDGING_PROMPT, NLI_PROMPT
+from config.template import render
 
 CRITERIA = {
     "Coverage": {
@@ -36,14 +38,33 @@ CRITERIA = {
 
 
 class Judge:
-    def __init__(self, model: str, api_key: str, api_url: str, database=None) -> None:
+    def __init__(
+        self, model: str, api_key: str, api_url: str, database=None, batch=None
+    ) -> None:
 
         self.model, self.api_key, self.api_url = model, api_key, api_url
-        self.api_model = APIModel(self.model, self.api_key, self.api_url)
+        # evaluation yields to outlining and writing in the shared scheduler;
+        # with a BatchRunner the NLI checks go through the provider's Batch API
+        self.api_model = APIModel(
+            self.model,
+            self.api_key,
+            self.api_url,
+            stage="judge",
+            job=new_job_id("judge"),
+            batch=batch,
+        )
         self.db = database
 
         self.token_counter = tokenCounter()
-        self.input_token_usage, self.output_token_usage = 0, 0
+
+    @property
+    def input_token_usage(self):
+        # provider-reported usage of this judge's job, see APIModel.usage
+        return self.api_model.usage.job(self.api_model.job)["prompt_tokens"]
+
+    @property
+    def output_token_usage(self):
+        return self.api_model.usage.job(self.api_model.job)["completion_tokens"]
 
     def compute_price(self):
         return self.token_counter.compute_price(
@@ -53,10 +74,7 @@ class Judge:
         )
 
     def __generate_prompt(self, template, paras):
-        prompt = template
-        for k in paras.keys():
-            prompt = prompt.replace(f"[{k}]", paras[k])
-        return prompt
+        return render(template, paras)
 
     def criteria_based_judging(self, survey, topic, criterion):
         """
@@ -91,8 +109,7 @@ class Judge:
             "Score 5 Description": criterion_paras["score5"],
         }
         prompt = self.__generate_prompt(CRITERIA_BASED_JUDGING_PROMPT, content_paras)
-        self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
-        scores = (self.api_model.chat(prompt, temperature=0),)
+        scores = (self.api_model.chat(prompt),)
         return scores
 
     def __criteria_based_judging(self, topic, survey, criterion, res_l, idx):
@@ -107,8 +124,7 @@ class Judge:
                 f"score {score}"
             ]
         prompt = self.__generate_prompt(CRITERIA_BASED_JUDGING_PROMPT, content_paras)
-        self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
-        scores = self.api_model.chat(prompt, temperature=0)
+        scores = self.api_model.chat(prompt)
         res_l[idx] = self.extract_num(scores)
         return scores
 
@@ -155,9 +171,7 @@ class Judge:
         content_paras = {"SOURCE": "\n".join(sources), "CLAIM": claim}
         prompt = self.__generate_prompt(NLI_PROMPT, content_paras)
 
-        self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
-
-        res = self.api_model.chat(prompt, temperature=0)
+        res = self.api_model.chat(prompt)
 
         if "yes" in res.lower():
             res_l[idx] += 1
@@ -169,9 +183,8 @@ class Judge:
     def __relevant(self, sources, com_sources, claim, res_l, idx):
         content_paras = {"SOURCE": "\n".join(sources), "CLAIM": claim}
         prompt = self.__generate_prompt(NLI_PROMPT, content_paras)
-        self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
 
-        res = self.api_model.chat(prompt, temperature=0)
+        res = self.api_model.chat(prompt)
 
         if "yes" in res.lower():
             res_l[idx] += 1
@@ -179,8 +192,7 @@ class Judge:
         else:
             content_paras = {"SOURCE": "\n".join(com_sources), "CLAIM": claim}
             prompt = self.__generate_prompt(NLI_PROMPT, content_paras)
-            self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
-            res = self.api_model.chat(prompt, temperature=0)
+            res = self.api_model.chat(prompt)
             if "yes" in res.lower():
                 res_l[idx] += 0
                 return 0
@@ -222,6 +234,9 @@ class Judge:
             int(index): ids_to_title[idx] for index, idx in references.items()
         }
 
+        if self.api_model.batch is not None:
+            return self.__bulk_citation_quality(claims, sources_ids, index_to_paper)
+
         thread_l = []
         scores = [0] * len(claims)
         for i in range(len(claims)):
@@ -256,3 +271,53 @@ class Judge:
         precisions = np.array(precisions)
 
         return np.array(scores).mean(), precisions.sum() / citation_num
+
+    def __nli_prompt(self, sources, claim):
+        return self.__generate_prompt(
+            NLI_PROMPT, {"SOURCE": "\n".join(sources), "CLAIM": claim}
+        )
+
+    def __bulk_citation_quality(self, claims, sources_ids, index_to_paper):
+        """citation_quality with every NLI round submitted as one batch."""
+        responses = self.api_model.bulk_chat(
+            [
+                self.__nli_prompt([index_to_paper[i] for i in ids], claim)
+                for claim, ids in zip(claims, sources_ids)
+            ]
+        )
+        scores = [int("yes" in res.lower()) for res in responses]
+
+        # a citation is relevant if it supports the claim on its own, or if the
+        # other citations do not support it without it
+        pairs = [
+            (j, index)
+            for j, ids in enumerate(sources_ids)
+            if scores[j] == 1
+            for index in ids
+        ]
+        alone = self.api_model.bulk_chat(
+            [
+                self.__nli_prompt([index_to_paper[index]], claims[j])
+                for j, index in pairs
+            ]
+        )
+        rest = [p for p, res in zip(pairs, alone) if "yes" not in res.lower()]
+        others = self.api_model.bulk_chat(
+            [
+                self.__nli_prompt(
+                    [index_to_paper[_] for _ in sources_ids[j] if not _ == index],
+                    claims[j],
+                )
+                for j, index in rest
+            ]
+        )
+        precisions = [0] * len(claims)
+        for (j, _), res in zip(pairs, alone):
+            if "yes" in res.lower():
+                precisions[j] += 1
+        for (j, _), res in zip(rest, others):
+            if "yes" not in res.lower():
+                precisions[j] += 1
+        citation_num = sum(len(ids) for ids in sources_ids)
+
+        return np.array(scores).mean(), np.array(precisions).sum() / citation_num
@@ -1,24 +1,65 @@
+import concurrent.futures
 import json
+import time
 from tqdm import trange
 from ComfyUI_Autosurvey.src.core.model import APIModel
+from ComfyUI_Autosurvey.src.core.scheduler import new_job_id
+from ComfyUI_Autosurvey.src.core.routing import ModelRouter
+from ComfyUI_Autosurvey.src.core.breaker import CircuitOpenError
 from ComfyUI_Autosurvey.src.database.database import Database
 from ComfyUI_Autosurvey.src.utils.utils import tokenCounter
+from ComfyUI_Autosurvey.src.utils.context import (
+    PAPER_LIST_BUDGETS,
+    balanced_cuts,
+    chunk_loads,
+    pack_papers,
+)
 from ComfyUI_Autosurvey.src.config.prompt_zh import (
     ROUGH_OUTLINE_PROMPT,
     MERGING_OUTLINE_PROMPT,
     SUBSECTION_OUTLINE_PROMPT,
     EDIT_FINAL_OUTLINE_PROMPT,
 )
+from ComfyUI_Autosurvey.src.config.template import render
 import folder_paths
 
 
 class outlineWriter:
-    def __init__(self, model: APIModel, database: Database) -> None:
-        self.api_model = model
+    def __init__(
+        self, model: APIModel, database: Database, routes=None, paper_budget=None
+    ) -> None:
+        # interactive outlining runs ahead of writing and evaluation;
+        # `routes` maps "outline"/"edit" to other models than `model`
+        self.router = ModelRouter(model, routes)
+        job = new_job_id("outline")
+        self.api_model = self.router.route("outline", job)
+        self.edit_model = self.router.route("edit", job)
         self.db = database
         self.token_counter = tokenCounter()
+        # tokens of the [PAPER LIST] of a subsection outline prompt
+        self.paper_budget = paper_budget or PAPER_LIST_BUDGETS["outline"]
+        # what pack_papers left out of each section's paper list
+        self.packing = []
+        # per level timing of tree_merge_outlines
+        self.merge_levels = []
+        # per section retrieval and generation time of generate_subsection_outlines
+        self.section_timings = []
+
+    def routing_stats(self):
+        """Which model served each stage of this writer, with its usage."""
+        return self.router.stats(self.api_model.job)
 
-    def draft_outline(self, topic, reference_num=600, section_num=6, chunk_size=30000):
+    def draft_outline(
+        self,
+        topic,
+        reference_num=600,
+        section_num=6,
+        chunk_size=30000,
+        merge_fan_in=0,
+        retrieval_workers=1,
+    ):
+        """`merge_fan_in` k >= 2 merges the rough outlines k at a time, level by
+        level, instead of all of them in one prompt."""
         # Get database
         references_ids = self.db.get_ids_from_query(
             topic, num=reference_num, shuffle=True
@@ -43,15 +84,22 @@ class outlineWriter:
         print(outlines)
         section_outline = outlines[0]
         # merge outline
-        if len(outlines) > 1:
+        if len(outlines) > 1 and merge_fan_in >= 2:
+            section_outline = self.tree_merge_outlines(
+                topic=topic, outlines=outlines, fan_in=merge_fan_in
+            )
+        elif len(outlines) > 1:
             section_outline = self.merge_outlines(topic=topic, outlines=outlines)
         # generate subsection-level outline
         subsection_outlines = self.generate_subsection_outlines(
-            topic=topic, section_outline=section_outline, rag_num=50
+            topic=topic,
+            section_outline=section_outline,
+            rag_num=50,
+            retrieval_workers=retrieval_workers,
         )
         merged_outline = self.process_outlines(section_outline, subsection_outlines)
         # edit final outline
-        final_outline = self.edit_final_outline(merged_outline)
+        final_outline = self.edit_final_outline(topic, merged_outline)
         with open(f"{folder_paths.get_output_directory()}/final_outline.md", "w") as f:
             f.write(final_outline)
         return final_outline
@@ -78,75 +126,197 @@ class outlineWriter:
                 },
             )
             prompts.append(prompt)
-        outlines = self.api_model.batch_chat(text_batch=prompts, temperature=1)
+        outlines = self.api_model.batch_chat(text_batch=prompts)
 
         return outlines
 
     def merge_outlines(self, topic, outlines):
+        prompt = self.__merge_prompt(topic, outlines)
+
+        outline = self.api_model.chat(prompt)
+        return outline
+
+    def tree_merge_outlines(self, topic, outlines, fan_in=4):
+        """Merge groups of `fan_in` outlines in parallel, then the results,
+        until one outline is left. The timing of each level is kept in
+        `self.merge_levels`."""
+        self.merge_levels = []
+        level = 0
+        while len(outlines) > 1:
+            start = time.time()
+            groups = [
+                outlines[i : i + fan_in] for i in range(0, len(outlines), fan_in)
+            ]
+            # a group of one outline moves up to the next level as it is
+            merging = [g for g in groups if len(g) > 1]
+            merged = iter(
+                self.api_model.batch_chat(
+                    [self.__merge_prompt(topic, g) for g in merging]
+                )
+            )
+            results = [next(merged) if len(g) > 1 else g[0] for g in groups]
+            failed = [j for j, o in enumerate(results) if o in (None, "No response")]
+            if failed:
+                raise RuntimeError(f"LLM merge calls {failed} failed at level {level}")
+            self.merge_levels.append(
+                {
+                    "level": level,
+                    "inputs": len(outlines),
+                    "calls": len(merging),
+                    "seconds": time.time() - start,
+                }
+            )
+            print(
+                f"Merge level {level}: {len(outlines)} outlines -> {len(results)} "
+                f"in {time.time() - start:.1f}s"
+            )
+            outlines = results
+            level += 1
+        return outlines[0]
+
+    def __merge_prompt(self, topic, outlines):
         outline_texts = ""
         for i, o in zip(range(len(outlines)), outlines):
             outline_texts += f"---\noutline_id: {i}\n\noutline_content:\n\n{o}\n"
         outline_texts += "---\n"
-        prompt = self.__generate_prompt(
+        return self.__generate_prompt(
             MERGING_OUTLINE_PROMPT,
             paras={"OUTLINE LIST": outline_texts, "TOPIC": topic},
         )
 
-        outline = self.api_model.chat(prompt, temperature=1)
-        return outline
+    def generate_subsection_outlines(
+        self, topic, section_outline, rag_num, retrieval_workers=1
+    ):
+        """Send each section's prompt to the LLM as soon as its papers are
+        retrieved, while the other sections are still retrieving.
 
-    def generate_subsection_outlines(self, topic, section_outline, rag_num):
+        `retrieval_workers` > 1 also queries the database concurrently, for
+        backends whose client is thread-safe.
+        """
         survey_title, survey_sections, survey_section_descriptions = (
             self.extract_title_sections_descriptions(section_outline)
         )
+        self.section_timings = [
+            {"section": name, "retrieval": 0.0, "generation": 0.0}
+            for name in survey_sections
+        ]
+        sub_outlines = ["No response"] * len(survey_sections)
+        start = time.time()
 
-        prompts = []
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(retrieval_workers, 1)
+        ) as retrievers, concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(len(survey_sections), 1)
+        ) as generators:
+            retrievals = {
+                retrievers.submit(
+                    self.__timed_retrieval,
+                    i,
+                    topic,
+                    section_outline,
+                    section_name,
+                    section_description,
+                    rag_num,
+                ): i
+                for i, (section_name, section_description) in enumerate(
+                    zip(survey_sections, survey_section_descriptions)
+                )
+            }
+            futures = {}
+            # a single retriever works through the sections in order
+            for future in concurrent.futures.as_completed(retrievals):
+                idx = retrievals[future]
+                prompt = future.result()
+                futures[generators.submit(self.__timed_chat, prompt, idx)] = idx
+            circuit_open = None
+            for future in concurrent.futures.as_completed(futures):
+                idx = futures[future]
+                try:
+                    sub_outlines[idx] = future.result()
+                except CircuitOpenError as exc:
+                    circuit_open = exc
+                except Exception as exc:
+                    print(f"Section {idx} generated an exception: {exc}")
+        if circuit_open is not None:
+            raise circuit_open
 
-        for section_name, section_description in zip(
-            survey_sections, survey_section_descriptions
-        ):
-            references_ids = self.db.get_ids_from_query(
-                section_description, num=rag_num, shuffle=True
+        for t in self.section_timings:
+            print(
+                f"Subsection outline of {t['section']}: retrieval "
+                f"{t['retrieval']:.2f}s, generation {t['generation']:.2f}s"
             )
-            references_infos = self.db.get_paper_info_from_ids(references_ids)
+        print(f"Subsection outlines done in {time.time() - start:.2f}s")
+        return sub_outlines
 
-            references_titles = [r["title"] for r in references_infos]
-            references_papers = [r["content"] for r in references_infos]
-            paper_texts = ""
-            for i, t, p in zip(
-                range(len(references_papers)), references_titles, references_papers
-            ):
-                paper_texts += f"---\npaper_title: {t}\n\npaper_content:\n\n{p}\n"
-            paper_texts += "---\n"
-            prompt = self.__generate_prompt(
-                SUBSECTION_OUTLINE_PROMPT,
-                paras={
-                    "OVERALL OUTLINE": section_outline,
-                    "SECTION NAME": section_name,
-                    "SECTION DESCRIPTION": section_description,
-                    "TOPIC": topic,
-                    "PAPER LIST": paper_texts,
-                },
-            )
-            prompts.append(prompt)
+    def __timed_retrieval(self, idx, *args):
+        start = time.time()
+        try:
+            return self.__subsection_outline_prompt(*args)
+        finally:
+            self.section_timings[idx]["retrieval"] = time.time() - start
 
-        sub_outlines = self.api_model.batch_chat(prompts, temperature=1)
+    def __timed_chat(self, prompt, idx):
+        start = time.time()
+        try:
+            return self.api_model.chat(prompt)
+        finally:
+            self.section_timings[idx]["generation"] = time.time() - start
 
-        return sub_outlines
+    def __subsection_outline_prompt(
+        self, topic, section_outline, section_name, section_description, rag_num
+    ):
+        references_ids = self.db.get_ids_from_query(
+            section_description, num=rag_num, shuffle=True
+        )
+        references_infos = self.db.get_paper_info_from_ids(references_ids)
 
-    def edit_final_outline(self, outline):
+        references_titles = [r["title"] for r in references_infos]
+        references_papers = [r["content"] for r in references_infos]
+        packed = pack_papers(
+            references_titles,
+            references_papers,
+            self.paper_budget,
+            self.token_counter,
+        )
+        self.__record_packing(section_name, packed)
+        paper_texts = packed.text
+        prompt = self.__generate_prompt(
+            SUBSECTION_OUTLINE_PROMPT,
+            paras={
+                "OVERALL OUTLINE": section_outline,
+                "SECTION NAME": section_name,
+                "SECTION DESCRIPTION": section_description,
+                "TOPIC": topic,
+                "PAPER LIST": paper_texts,
+            },
+        )
+        return prompt
+
+    def __record_packing(self, section_name, packed):
+        self.packing.append(dict(packed.stats(), section=section_name))
+        if packed.dropped or packed.truncated is not None:
+            print(
+                f"Paper list of {section_name}: dropped {len(packed.dropped)} "
+                f"papers over the {packed.budget} token budget"
+                + (", truncated the top one" if packed.truncated is not None else "")
+            )
+
+    def packing_stats(self):
+        return list(self.packing)
+
+    def edit_final_outline(self, topic, outline):
 
         prompt = self.__generate_prompt(
-            EDIT_FINAL_OUTLINE_PROMPT, paras={"OVERALL OUTLINE": outline}
+            EDIT_FINAL_OUTLINE_PROMPT,
+            paras={"OVERALL OUTLINE": outline, "TOPIC": topic},
         )
-        outline = self.api_model.chat(prompt, temperature=1)
+        outline = self.edit_model.chat(prompt)
+        if outline is None:
+            raise RuntimeError("LLM edit call of the outline failed after retries")
         return outline.replace("<format>\n", "").replace("</format>", "")
 
     def __generate_prompt(self, template, paras):
-        prompt = template
-        for k in paras.keys():
-            prompt = prompt.replace(f"[{k}]", paras[k])
-        return prompt
+        return render(template, paras)
 
     def extract_title_sections_descriptions(self, outline: str):
         title = outline.split("Title: ")[1].split("\n")[0]
@@ -171,19 +341,16 @@ class outlineWriter:
                 )
         return subsections, subdescriptions
 
-    def chunking(self, papers, titles, chunk_size=14000):
+    def chunking(self, papers, titles, chunk_size=14000, counts=None, tolerance=0.1):
+        """Split papers into contiguous chunks of balanced token length.
+
+        No chunk exceeds `chunk_size` tokens unless it is a single paper;
+        `counts` are the token counts of `papers` if the caller already has them.
+        """
         paper_chunks, title_chunks = [], []
-        total_length = self.token_counter.num_tokens_from_list_string(papers)
-        num_of_chunks = int(total_length / chunk_size) + 1
-        avg_len = int(total_length / num_of_chunks) + 1
-        split_points = []
-        l = 0
-        for j in range(len(papers)):
-            l += self.token_counter.num_tokens_from_string(papers[j])
-            if l > avg_len:
-                l = 0
-                split_points.append(j)
-                continue
+        if counts is None:
+            counts = self.token_counter.num_tokens_from_strings(papers)
+        split_points = balanced_cuts(counts, chunk_size, tolerance)
         start = 0
         for point in split_points:
             paper_chunks.append(papers[start:point])
@@ -191,6 +358,12 @@ class outlineWriter:
             start = point
         paper_chunks.append(papers[start:])
         title_chunks.append(titles[start:])
+        loads = chunk_loads(counts, split_points)
+        if sum(loads):
+            print(
+                f"Chunked {len(papers)} papers into {len(loads)} chunks, "
+                f"max/mean tokens {max(loads) / (sum(loads) / len(loads)):.3f}"
+            )
         return paper_chunks, title_chunks
 
     def process_outlines(self, section_outline, sub_outlines):
@@ -5,23 +5,62 @@ import copy
 from tqdm import tqdm
 from custom_nodes.ComfyUI_Autosurvey.src.database.database import Database
 from ComfyUI_Autosurvey.src.core.model import APIModel
-from ComfyUI_Autosurvey.src.utils.utils import tokenCounter
+from ComfyUI_Autosurvey.src.core.scheduler import new_job_id
+from ComfyUI_Autosurvey.src.core.breaker import CircuitOpenError
+from ComfyUI_Autosurvey.src.core.routing import ModelRouter
+from ComfyUI_Autosurvey.src.core.profiles import subsection_max_tokens
+from ComfyUI_Autosurvey.src.utils.utils import tokenCounter, formatStripper
+from ComfyUI_Autosurvey.src.utils.context import PAPER_LIST_BUDGETS, pack_papers
 from ComfyUI_Autosurvey.src.config.prompt_zh import (
     SUBSECTION_WRITING_PROMPT,
     LCE_PROMPT,
     CHECK_CITATION_PROMPT,
 )
+from ComfyUI_Autosurvey.src.config.template import render
 import folder_paths
 
+PAPER_ENTRY = "---\n\npaper_title: {title}\n\npaper_content:\n\n{content}\n"
+
 
 class subsectionWriter:
     def __init__(
-        self, model:APIModel, database: Database
+        self,
+        model:APIModel,
+        database: Database,
+        on_token=None,
+        routes=None,
+        paper_budget=None,
     ) -> None:
-        self.api_model = model
+        # one scheduler job per writer, drafting, checking and refining share it;
+        # `routes` maps "check"/"refine"/"write" to other models than `model`
+        self.router = ModelRouter(model, routes)
+        job = new_job_id("write")
+        self.api_model = self.router.route("write", job)
+        self.check_model = self.router.route("check", job)
+        self.refine_model = self.router.route("refine", job)
         self.db = database
+        # on_token(section_idx, subsection_idx, text) receives drafts as they stream
+        self.on_token = on_token
         self.token_counter = tokenCounter()
-        self.input_token_usage, self.output_token_usage = 0, 0
+        # tokens of the [PAPER LIST] of a writing or citation check prompt
+        self.paper_budget = paper_budget or PAPER_LIST_BUDGETS["write"]
+        # what pack_papers left out of each subsection's paper list
+        self.packing = []
+
+    @property
+    def input_token_usage(self):
+        # provider-reported usage of this writer's job over all routed models
+        usage = self.router.usage(self.api_model.job).values()
+        return sum(u["prompt_tokens"] for u in usage)
+
+    @property
+    def output_token_usage(self):
+        usage = self.router.usage(self.api_model.job).values()
+        return sum(u["completion_tokens"] for u in usage)
+
+    def routing_stats(self):
+        """Which model served each stage of this writer, with its usage."""
+        return self.router.stats(self.api_model.job)
 
     def write(
         self,
@@ -40,12 +79,12 @@ class subsectionWriter:
         section_content = [[]] * len(parsed_outline["sections"])
 
         # 初始化每个章节的参考文献
-        section_paper_texts = [[]] * len(parsed_outline["sections"])
+        section_paper_texts = [[] for _ in parsed_outline["sections"]]
 
         # 初始化所有参考文献的ID
         total_ids = []
         # 初始化每个章节的参考文献ID
-        section_references_ids = [[]] * len(parsed_outline["sections"])
+        section_references_ids = [[] for _ in parsed_outline["sections"]]
         # 遍历每个章节
         for i in range(len(parsed_outline["sections"])):
             # 获取每个章节的子章节描述
@@ -76,26 +115,28 @@ class subsectionWriter:
         # 遍历每个章节
         for i in range(len(parsed_outline["sections"])):
             # 遍历每个章节的参考文献ID
-            for references_ids in section_references_ids[i]:
+            for j, references_ids in enumerate(section_references_ids[i]):
 
                 # 获取参考文献的标题
                 references_titles = [temp_title_dic[_] for _ in references_ids]
                 # 获取参考文献的摘要
                 references_papers = [temp_abs_dic[_] for _ in references_ids]
-                # 初始化参考文献的文本
-                paper_texts = ""
-                # 遍历每个参考文献的标题和摘要
-                for t, p in zip(references_titles, references_papers):
-                    # 将标题和摘要添加到参考文献的文本中
-                    paper_texts += f"---\n\npaper_title: {t}\n\npaper_content:\n\n{p}\n"
-                # 添加参考文献的文本
-                paper_texts += "---\n"
+                # 按排名放入整篇参考文献，直到用完token预算
+                packed = pack_papers(
+                    references_titles,
+                    references_papers,
+                    self.paper_budget,
+                    self.token_counter,
+                    entry=PAPER_ENTRY,
+                )
+                self.__record_packing(parsed_outline["subsections"][i][j], packed)
 
                 # 将参考文献的文本添加到每个章节的参考文献文本中
-                section_paper_texts[i].append(paper_texts)
+                section_paper_texts[i].append(packed.text)
 
         # 初始化线程列表
         thread_l = []
+        errors = []
         # 遍历每个章节
         for i in range(len(parsed_outline["sections"])):
             # print(section_paper_texts[i])
@@ -104,7 +145,7 @@ class subsectionWriter:
             # print(parsed_outline['subsection_descriptions'][i])
             # 创建线程，目标函数为write_subsection_with_reflection，参数为section_paper_texts[i]，topic，outline，parsed_outline['sections'][i]，parsed_outline['subsections'][i]，parsed_outline['subsection_descriptions'][i]，section_content，i，rag_num,str(subsection_len)
             thread = threading.Thread(
-                target=self.write_subsection_with_reflection,
+                target=self.__guarded(self.write_subsection_with_reflection, errors),
                 args=(
                     section_paper_texts[i],
                     topic,
@@ -127,6 +168,7 @@ class subsectionWriter:
         # 等待所有线程结束
         for thread in thread_l:
             thread.join()
+        self.__raise_errors(errors)
         # 生成文档
         raw_survey = self.generate_document(parsed_outline, section_content)
         with open(f"{folder_paths.get_output_directory()}/raw_survey.md", "w") as f:
@@ -158,17 +200,33 @@ class subsectionWriter:
                 raw_references,
             )  # , mindmap
 
+    def __record_packing(self, subsection, packed):
+        self.packing.append(dict(packed.stats(), subsection=subsection))
+        if packed.dropped or packed.truncated is not None:
+            print(
+                f"Paper list of {subsection}: dropped {len(packed.dropped)} "
+                f"papers over the {packed.budget} token budget"
+                + (", truncated the top one" if packed.truncated is not None else "")
+            )
+
+    def packing_stats(self):
+        return list(self.packing)
+
     def compute_price(self):
-        return self.token_counter.compute_price(
-            input_tokens=self.input_token_usage,
-            output_tokens=self.output_token_usage,
-            model=self.model,
+        return sum(
+            self.token_counter.compute_price(
+                input_tokens=u["prompt_tokens"],
+                output_tokens=u["completion_tokens"],
+                model=model,
+            )
+            for model, u in self.router.usage(self.api_model.job).items()
         )
 
     def refine_subsections(self, topic, outline, section_content):
         section_content_even = copy.deepcopy(section_content)
 
         thread_l = []
+        errors = []
         for i in range(len(section_content)):
             for j in range(len(section_content[i])):
                 if j % 2 == 0:
@@ -179,13 +237,14 @@ class subsectionWriter:
                     else:
                         contents = section_content[i][j - 1 : j + 2]
                     thread = threading.Thread(
-                        target=self.lce,
+                        target=self.__guarded(self.lce, errors),
                         args=(topic, outline, contents, section_content_even[i], j),
                     )
                     thread_l.append(thread)
                     thread.start()
         for thread in thread_l:
             thread.join()
+        self.__raise_errors(errors)
 
         final_section_content = copy.deepcopy(section_content_even)
 
@@ -198,16 +257,39 @@ class subsectionWriter:
                     else:
                         contents = section_content_even[i][j - 1 : j + 2]
                     thread = threading.Thread(
-                        target=self.lce,
+                        target=self.__guarded(self.lce, errors),
                         args=(topic, outline, contents, final_section_content[i], j),
                     )
                     thread_l.append(thread)
                     thread.start()
         for thread in thread_l:
             thread.join()
+        self.__raise_errors(errors)
 
         return final_section_content
 
+    def __guarded(self, target, errors):
+        # exceptions of worker threads are collected and re-raised by the caller
+        def run(*args):
+            try:
+                target(*args)
+            except Exception as exc:
+                errors.append(exc)
+
+        return run
+
+    def __raise_errors(self, errors):
+        if errors:
+            # an open circuit explains the other failures, report it first
+            circuit = [e for e in errors if isinstance(e, CircuitOpenError)]
+            raise (circuit or errors)[0]
+
+    def __strip_format(self, contents, stage):
+        failed = [j for j, c in enumerate(contents) if c is None]
+        if failed:
+            raise RuntimeError(f"LLM {stage} calls {failed} failed after retries")
+        return [c.replace("<format>", "").replace("</format>", "") for c in contents]
+
     def write_subsection_with_reflection(
         self,
         paper_texts_l,
@@ -238,21 +320,21 @@ class subsectionWriter:
                     "PAPER LIST": paper_texts_l[j],
                     "SECTION NAME": section,
                     "WORD NUM": str(subsection_len),
-                    "CITATION NUM": str(citation_num),
                 },
             )
             prompts.append(prompt)
 
-        self.input_token_usage += self.token_counter.num_tokens_from_list_string(
-            prompts
-        )
-        contents = self.api_model.batch_chat(prompts, temperature=1)
-        self.output_token_usage += self.token_counter.num_tokens_from_list_string(
-            contents
-        )
-        contents = [
-            c.replace("<format>", "").replace("</format>", "") for c in contents
-        ]
+        # drafts and their checked versions must fit the requested length
+        max_tokens = subsection_max_tokens(words=subsection_len)
+        consumer = self.__stream_consumer(idx, len(prompts))
+        try:
+            contents = self.api_model.with_options(max_tokens=max_tokens).batch_chat(
+                prompts, on_token=consumer
+            )
+        finally:
+            if consumer is not None:
+                consumer.flush()
+        contents = self.__strip_format(contents, "write")
 
         prompts = []
         for content, paper_texts in zip(contents, paper_texts_l):
@@ -266,31 +348,39 @@ class subsectionWriter:
                     },
                 )
             )
-        self.input_token_usage += self.token_counter.num_tokens_from_list_string(
-            prompts
-        )
-        contents = self.api_model.batch_chat(prompts, temperature=1)
-        self.output_token_usage += self.token_counter.num_tokens_from_list_string(
-            contents
-        )
-        contents = [
-            c.replace("<format>", "").replace("</format>", "") for c in contents
-        ]
+        check_model = self.check_model.with_options(max_tokens=max_tokens)
+        contents = check_model.batch_chat(prompts)
+        contents = self.__strip_format(contents, "check")
 
         res_l[idx] = contents
         return contents
 
+    def __stream_consumer(self, idx, num):
+        """on_token of a batch of `num` drafts; its `flush()` passes on the text
+        held back as a possible partial tag once the streams have ended."""
+        if self.on_token is None:
+            return None
+        strippers = [formatStripper() for _ in range(num)]
+
+        def consume(j, delta):
+            text = strippers[j].feed(delta)
+            if text:
+                self.on_token(idx, j, text)
+
+        def flush():
+            for j, stripper in enumerate(strippers):
+                text = stripper.flush()
+                if text:
+                    self.on_token(idx, j, text)
+
+        consume.flush = flush
+        return consume
+
     def __generate_prompt(self, template, paras):
-        prompt = template
-        for k in paras.keys():
-            prompt = prompt.replace(f"[{k}]", paras[k])
-        return prompt
+        return render(template, paras)
 
     def generate_prompt(self, template, paras):
-        prompt = template
-        for k in paras.keys():
-            prompt = prompt.replace(f"[{k}]", paras[k])
-        return prompt
+        return render(template, paras)
 
     def lce(self, topic, outline, contents, res_l, idx):
         """
@@ -333,22 +423,20 @@ class subsectionWriter:
         prompt = self.__generate_prompt(
             LCE_PROMPT,
             paras={
-                "OVERALL OUTLINE": outline,
                 "PREVIOUS": contents[0],
                 "FOLLOWING": contents[2],
                 "TOPIC": topic,
                 "SUBSECTION": contents[1],
             },
         )
-        self.input_token_usage += self.token_counter.num_tokens_from_string(prompt)
-        refined_content = (
-            self.api_model.chat(prompt, temperature=1)
-            .replace("<format>", "")
-            .replace("</format>", "")
-        )
-        self.output_token_usage += self.token_counter.num_tokens_from_string(
-            refined_content
+        # the refined subsection is about as long as the one it replaces
+        max_tokens = subsection_max_tokens(
+            tokens=self.token_counter.num_tokens_from_string(contents[1])
         )
+        refine_model = self.refine_model.with_options(max_tokens=max_tokens)
+        refined_content = self.__strip_format(
+            [refine_model.chat(prompt)], "refine"
+        )[0]
         #   print(prompt+'\n---------------------------------\n'+refined_content)
         res_l[idx] = refined_content
         return refined_content.replace("Here is the refined subsection:\n", "")
@@ -408,24 +496,33 @@ class subsectionWriter:
         return self.replace_citations_with_numbers(citations, survey)
 
     def generate_document(self, parsed_outline, subsection_contents):
-        document = []
+        return "".join(self.iter_document(parsed_outline, subsection_contents))
+
+    def iter_document(self, parsed_outline, subsection_contents):
+        """Yield the markdown of generate_document piece by piece.
 
+        A subsection content may be a string or an iterable of text chunks, e.g.
+        a token stream, which is passed through as it is consumed.
+        """
         # Append title
         title = parsed_outline["title"]
-        document.append(f"# {title}\n")
+        yield f"# {title}\n"
 
         # Iterate over sections and their content
         for i, section in enumerate(parsed_outline["sections"]):
-            document.append(f"## {section}\n")
+            yield f"\n## {section}\n"
             # Append subsections and their contents
             for j, subsection in enumerate(parsed_outline["subsections"][i]):
-                document.append(f"### {subsection}\n")
-                #      document.append(f"{parsed_outline['subsection_descriptions'][i][j]}\n")
+                yield f"\n### {subsection}\n"
                 # Append detailed content for each subsection
                 if i < len(subsection_contents) and j < len(subsection_contents[i]):
-                    document.append(subsection_contents[i][j] + "\n")
-
-        return "\n".join(document)
+                    content = subsection_contents[i][j]
+                    yield "\n"
+                    if isinstance(content, str):
+                        yield content
+                    else:
+                        yield from content
+                    yield "\n"
 
     def process_outlines(self, section_outline, sub_outlines):
         res = ""
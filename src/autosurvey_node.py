@@ -1,8 +1,12 @@
 from .database.database import Database
 from .core.model import APIModel
+from .core.breaker import CircuitOpenError
+from .core.probe import probe
 from .agents.outline_writer import outlineWriter
 from .agents.writer import subsectionWriter
+import json
 import logging
+import comfy.utils
 
 def remove_descriptions(text):
     lines = text.split("\n")
@@ -64,6 +68,15 @@ class WriteOutline:
                 "chatmodel": ("CHATMODEL",),
                 "database": ("DB_CLIENT",),
             },
+            "optional": {
+                "health_check": ("BOOLEAN", {"default": True}),
+                # stage -> chat model, from a Model Routes node
+                "routes": ("MODEL_ROUTES",),
+                # merge rough outlines k at a time in a tree; 0 merges all at once
+                "merge_fan_in": ("INT", {"default": 0, "min": 0, "max": 64}),
+                # concurrent database queries while subsection outlines generate
+                "retrieval_workers": ("INT", {"default": 1, "min": 1, "max": 32}),
+            },
         }
 
     RETURN_TYPES = ("STRING",)
@@ -73,16 +86,47 @@ class WriteOutline:
     CATEGORY = "Senser/autosurvey"
 
     def write_outline(
-        self, autosurvey: AutoSurvey, chatmodel: APIModel, database: Database
+        self,
+        autosurvey: AutoSurvey,
+        chatmodel: APIModel,
+        database: Database,
+        health_check=True,
+        routes=None,
+        merge_fan_in=0,
+        retrieval_workers=1,
     ):
-        outline_writer = outlineWriter(model=chatmodel, database=database)
-        test_txt = chatmodel.chat("hello")
-        logging.info(test_txt)
-        final_outline = outline_writer.draft_outline(
-            autosurvey.topic,
-            autosurvey.outline_reference_num,
-            autosurvey.section_num,
+        outline_writer = outlineWriter(
+            model=chatmodel, database=database, routes=routes
         )
+        try:
+            if health_check:
+                # usually answered from the ChatModel node's recent probe, within
+                # the PROBE_TTL the model was configured with
+                test_txt = probe(chatmodel)
+                logging.info(test_txt)
+            final_outline = outline_writer.draft_outline(
+                autosurvey.topic,
+                autosurvey.outline_reference_num,
+                autosurvey.section_num,
+                merge_fan_in=merge_fan_in,
+                retrieval_workers=retrieval_workers,
+            )
+        except CircuitOpenError as e:
+            logging.error(f"Outline writing aborted: {e}")
+            raise RuntimeError(f"Outline writing aborted: {e}") from e
+        finally:
+            logging.info(
+                "Outline routing: "
+                f"{json.dumps(outline_writer.routing_stats(), indent=4)}"
+            )
+        logging.info(
+            "Subsection outline timings: "
+            f"{json.dumps(outline_writer.section_timings, ensure_ascii=False)}"
+        )
+        if outline_writer.merge_levels:
+            logging.info(
+                f"Outline merge levels: {json.dumps(outline_writer.merge_levels)}"
+            )
         return (final_outline,)
 
 
@@ -105,6 +149,13 @@ class WriteSection:
                 "chatmodel": ("CHATMODEL",),
                 "database": ("DB_CLIENT",),
             },
+            "optional": {
+                "stream": ("BOOLEAN", {"default": False}),
+                # what to do while the chat model's circuit breaker is open
+                "on_outage": (["abort", "pause"], {"default": "abort"}),
+                # stage -> chat model, from a Model Routes node
+                "routes": ("MODEL_ROUTES",),
+            },
         }
 
     RETURN_TYPES = ("STRING",)
@@ -120,26 +171,57 @@ class WriteSection:
         chatmodel: APIModel,
         database: Database,
         refinement=True,
+        stream=False,
+        on_outage="abort",
+        routes=None,
     ):
+        on_token = None
+        if stream:
+            on_token = self.stream_progress(outline, autosurvey.subsection_len)
+        # "pause" holds requests until the breaker lets a probe through again
+        on_open = "wait" if on_outage == "pause" else "fail"
+        chatmodel = chatmodel.with_options(on_open=on_open)
+        routes = {k: v.with_options(on_open=on_open) for k, v in (routes or {}).items()}
         subsection_writer = subsectionWriter(
-            model=chatmodel, database=database
+            model=chatmodel, database=database, on_token=on_token, routes=routes
         )
-        if refinement:
-            return (subsection_writer.write(
-                autosurvey.topic,
-                outline,
-                subsection_len=autosurvey.subsection_len,
-                rag_num=autosurvey.rag_num,
-                refining=True,
-            ),)
-        else:
-            return (subsection_writer.write(
-                autosurvey.topic,
-                outline,
-                subsection_len=autosurvey.subsection_len,
-                rag_num=autosurvey.rag_num,
-                refining=False,
-            ),)
+        try:
+            if refinement:
+                return (subsection_writer.write(
+                    autosurvey.topic,
+                    outline,
+                    subsection_len=autosurvey.subsection_len,
+                    rag_num=autosurvey.rag_num,
+                    refining=True,
+                ),)
+            else:
+                return (subsection_writer.write(
+                    autosurvey.topic,
+                    outline,
+                    subsection_len=autosurvey.subsection_len,
+                    rag_num=autosurvey.rag_num,
+                    refining=False,
+                ),)
+        except CircuitOpenError as e:
+            logging.error(f"Section writing aborted: {e}")
+            raise RuntimeError(f"Section writing aborted: {e}") from e
+        finally:
+            logging.info(
+                "Section routing: "
+                f"{json.dumps(subsection_writer.routing_stats(), indent=4)}"
+            )
+
+    def stream_progress(self, outline, subsection_len):
+        # expected text length of all drafts, used to scale the progress bar
+        total = max(outline.count("\n### ") * subsection_len, 1)
+        pbar = comfy.utils.ProgressBar(total)
+        received = [0]
+
+        def on_token(section_idx, subsection_idx, text):
+            received[0] = min(received[0] + len(text), total)
+            pbar.update_absolute(received[0], total)
+
+        return on_token
 
 
 AS_NODE_CLASS_MAPPINGS = {
@@ -1,30 +1,96 @@
 import json
 import logging
 import os
+import threading
 from .core.model import APIModel
+from .core.retry import RetryPolicy
+from .core.cache import get_cache
+from .core.endpoints import Endpoint
+from .core.hedging import HedgePolicy
+from .core.scheduler import get_scheduler
+from .core.breaker import CircuitBreaker
+from .core.probe import probe
+from .core.profiles import load_profiles
+from .core.routing import STAGES
+
+_lock = threading.Lock()
+_configs = {}
+_models = {}
+
+
+def load_config(path):
+    """Parse config.json once and again only after its mtime changes."""
+    mtime = os.stat(path).st_mtime
+    with _lock:
+        cached = _configs.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path, 'r') as f:
+        config = json.load(f)
+    with _lock:
+        _configs[path] = (mtime, config)
+    return config
 
 
 class ChatModel:
     def __init__(self):
         p = os.path.dirname(os.path.realpath(__file__))
         config_path = os.path.join(p, '../config.json')
-        with open(config_path, 'r') as f:
-            config = json.load(f)
+        config = load_config(config_path)
         self.API_KEY=config['API_KEY']
 
         self.API_URL=config['API_URL']
 
         self.AVAILABLE_MODELS=config['AVAILABLE_MODELS']
 
+        # optional RetryPolicy arguments, e.g. {"max_retries": 5, "deadline": 900}
+        self.RETRY=config.get('RETRY', {})
+
+        # optional ResponseCache arguments, e.g. {"max_age": 604800, "cache_sampled": false}
+        self.CACHE=config.get('CACHE', {})
+        self.CACHE_PATH=os.path.join(p, '../cache/llm_cache.sqlite')
+
+        # provider quota of the endpoint, e.g. {"RPM": 500, "TPM": 200000}
+        self.RATE_LIMITS=config.get('RATE_LIMITS') or {}
+
+        # optional pool of endpoints replacing API_URL/API_KEY, each entry like
+        # {"API_URL": ..., "API_KEY": ..., "WEIGHT": 1, "MAX_CONCURRENCY": 16, "RPM": ..., "TPM": ...}
+        self.ENDPOINTS=config.get('ENDPOINTS') or []
+
+        # optional HedgePolicy arguments enabling hedged requests, e.g. {"percentile": 0.95, "max_extra": 0.1}
+        self.HEDGE=config.get('HEDGE')
+
+        # cap on LLM requests in flight across all workflows of this process; when
+        # unset it starts at 64 and grows to the largest max_concurrency of a model
+        self.SCHEDULER_MAX_CONCURRENCY=(config.get('SCHEDULER') or {}).get('MAX_CONCURRENCY')
+
+        # CircuitBreaker arguments, e.g. {"failure_threshold": 5, "recovery_time": 30}
+        self.CIRCUIT_BREAKER=config.get('CIRCUIT_BREAKER') or {}
+
+        # seconds a successful "hello" probe stays valid for the same model, url and key
+        self.PROBE_TTL=config.get('PROBE_TTL', 300)
+
+        # per-stage generation settings overriding the defaults of core/profiles.py,
+        # e.g. {"write": {"temperature": 0.7, "max_tokens": 3000, "stop": ["</format>"]}}
+        self.PROFILES=config.get('PROFILES') or {}
+
+        # the settings that decide which APIModel instance a node execution gets
+        self.SIGNATURE=json.dumps(config, sort_keys=True)
+
     @classmethod
     def INPUT_TYPES(s):
+        node = s()
         return {
             "required": {
-                "name": (s().AVAILABLE_MODELS,),
+                "name": (node.AVAILABLE_MODELS,),
             },
             "optional": {
-                "api_url": ("STRING", {"default": s().API_URL}),
-                "api_key": ("STRING", {"default": s().API_KEY}),
+                "api_url": ("STRING", {"default": node.API_URL}),
+                "api_key": ("STRING", {"default": node.API_KEY}),
+                "max_concurrency": ("INT", {"default": 32, "min": 1, "max": 256}),
+                "use_async": ("BOOLEAN", {"default": False}),
+                "use_cache": ("BOOLEAN", {"default": False}),
+                "health_check": ("BOOLEAN", {"default": True}),
             },
         }
 
@@ -34,30 +100,119 @@ class ChatModel:
 
     CATEGORY = "Senser/chat"
 
-    def chat_bot(self, name, api_url, api_key):
+    def chat_bot(
+        self,
+        name,
+        api_url,
+        api_key,
+        max_concurrency=32,
+        use_async=False,
+        use_cache=False,
+        health_check=True,
+    ):
         if api_url is None:
             api_url = self.API_URL
         if api_key is None:
             api_key = self.API_KEY
-        model = APIModel(name, api_url=api_url, api_key=api_key)
-        resp = model.chat("hello")
-        logging.info(f"Chat model {name} response: {resp}")
+        model = self.get_model(
+            name, api_url, api_key, max_concurrency, use_async, use_cache
+        )
+        resp = None
+        if health_check:
+            resp = probe(model, ttl=self.PROBE_TTL)
+            logging.info(f"Chat model {name} response: {resp}")
         return model, json.dumps(
             {
                 "model": name,
                 "api_url": api_url,
                 "api_key": api_key,
-                "test": {"user": "hello", "answer": resp},
+                "test": {"user": "hello", "answer": resp} if health_check else None,
+                "endpoints": [
+                    {"api_url": e["api_url"], "weight": e["weight"], "limit": e["limit"]}
+                    for e in model.endpoint_stats()
+                ],
             },
             indent=4,
         )
 
+    def get_model(
+        self, name, api_url, api_key, max_concurrency, use_async, use_cache
+    ):
+        """Reuse the APIModel of an earlier execution with the same settings.
+
+        A model built from an older config.json is replaced, not kept beside
+        the new one.
+        """
+        args = (name, api_url, api_key, max_concurrency, use_async, use_cache)
+        with _lock:
+            signature, model = _models.get(args, (None, None))
+            if model is None or signature != self.SIGNATURE:
+                model = self.build_model(*args)
+                _models[args] = (self.SIGNATURE, model)
+            return model
+
+    def build_model(
+        self, name, api_url, api_key, max_concurrency, use_async, use_cache
+    ):
+        endpoints = [
+            Endpoint.from_config(e, max_concurrency=max_concurrency)
+            for e in self.ENDPOINTS
+        ]
+        model = APIModel(
+            name,
+            api_url=api_url,
+            api_key=api_key,
+            max_concurrency=max_concurrency,
+            use_async=use_async,
+            retry_policy=RetryPolicy(**self.RETRY),
+            cache=get_cache(self.CACHE_PATH, **self.CACHE) if use_cache else None,
+            rpm=self.RATE_LIMITS.get('RPM'),
+            tpm=self.RATE_LIMITS.get('TPM'),
+            endpoints=endpoints,
+            hedge=HedgePolicy(**self.HEDGE) if self.HEDGE is not None else None,
+            scheduler=get_scheduler(
+                self.SCHEDULER_MAX_CONCURRENCY,
+                min_concurrency=sum(e.max_concurrency for e in endpoints)
+                or max_concurrency,
+            ),
+            breaker=CircuitBreaker(**self.CIRCUIT_BREAKER),
+            profiles=load_profiles(self.PROFILES),
+            probe_ttl=self.PROBE_TTL,
+        )
+        return model
+
+
+class ModelRoutes:
+    """Routing table of the Write Outline / Write Section nodes.
+
+    Each connected chat model serves one stage; the other stages keep the
+    chat model connected to the writing node.
+    """
+
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {},
+            "optional": {stage: ("CHATMODEL",) for stage in STAGES},
+        }
+
+    RETURN_TYPES = ("MODEL_ROUTES",)
+    RETURN_NAMES = ("Model Routes",)
+    FUNCTION = "routes"
+
+    CATEGORY = "Senser/chat"
+
+    def routes(self, **models):
+        return ({k: v for k, v in models.items() if v is not None},)
+
 
 CM_NODE_CLASS_MAPPINGS = {
     "ChatModel": ChatModel,
+    "ModelRoutes": ModelRoutes,
 }
 
 # A dictionary that contains the friendly/humanly readable titles for the nodes
 CM_NODE_DISPLAY_NAME_MAPPINGS = {
     "ChatModel": "Chat Model",
+    "ModelRoutes": "Model Routes",
 }
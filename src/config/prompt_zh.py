@@ -70,7 +70,7 @@ MERGING_OUTLINE_PROMPT = '''
 
 以下是提供的候选大纲列表：
 ---
-[OVERALL OUTLINE]
+[OUTLINE LIST]
 ---
 每个大纲都包含一个标题和若干部分。
 每个部分后面都有一句简短的句子来描述这部分应该写什么。
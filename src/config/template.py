@@ -0,0 +1,90 @@
+import re
+import threading
+
+_lock = threading.Lock()
+_compiled = {}
+
+# every field name the agents fill in the prompts of prompt.py and prompt_zh.py;
+# other bracketed text such as "[NAME OF SECTION 1]" is part of the prompt
+PLACEHOLDERS = frozenset(
+    [
+        "CLAIM",
+        "DESCRIPTION",
+        "FOLLOWING",
+        "OUTLINE LIST",
+        "OVERALL OUTLINE",
+        "PAPER LIST",
+        "PREVIOUS",
+        "SECTION DESCRIPTION",
+        "SECTION NAME",
+        "SECTION NUM",
+        "SOURCE",
+        "SUBSECTION",
+        "SUBSECTION NAME",
+        "SURVEY",
+        "TOPIC",
+        "WORD NUM",
+        "Criterion Description",
+    ]
+    + [f"Score {score} Description" for score in range(1, 6)]
+)
+
+
+class PromptTemplate:
+    """A prompt split once into literal text and `[NAME]` fields.
+
+    Only the given field names are placeholders: prompts also contain
+    bracketed examples such as "[NAME OF SECTION 1]" that must stay as they
+    are. A name of PLACEHOLDERS found in the template but not given is an
+    error, so no prompt goes out with a field left unfilled. Rendering joins the pieces in a single pass, so substituted values
+    are never copied again or searched for further placeholders.
+    """
+
+    def __init__(self, template, fields) -> None:
+        fields = sorted(set(fields), key=len, reverse=True)
+        missing = [f for f in fields if f"[{f}]" not in template]
+        if missing:
+            raise ValueError(f"placeholders {missing} not found in prompt template")
+        unfilled = sorted(
+            f for f in PLACEHOLDERS - set(fields) if f"[{f}]" in template
+        )
+        if unfilled:
+            raise ValueError(f"placeholders {unfilled} of prompt template not filled")
+        self.fields = frozenset(fields)
+        if fields:
+            pattern = "|".join(re.escape(f"[{f}]") for f in fields)
+            self.__parts = re.split(f"({pattern})", template)
+        else:
+            self.__parts = [template]
+
+    def render(self, paras):
+        """Fill every field with `paras[field]`; keys must match the fields."""
+        if paras.keys() != self.fields:
+            raise ValueError(
+                f"prompt fields {sorted(self.fields)} got {sorted(paras.keys())}"
+            )
+        parts = list(self.__parts)
+        # literal text at even indices, "[FIELD]" at odd ones
+        for i in range(1, len(parts), 2):
+            parts[i] = paras[parts[i][1:-1]]
+        return "".join(parts)
+
+
+def compile_prompt(template, fields):
+    """The PromptTemplate of `template` with `fields`, compiled on first use."""
+    key = (template, frozenset(fields))
+    compiled = _compiled.get(key)
+    if compiled is None:
+        compiled = PromptTemplate(template, fields)
+        with _lock:
+            _compiled[key] = compiled
+    return compiled
+
+
+def render(template, paras):
+    """Substitute `paras` into `template` in one pass.
+
+    Raises ValueError if a key of `paras` has no placeholder in the template
+    or a placeholder of the template has no key in `paras`.
+    """
+    return compile_prompt(template, paras.keys()).render(paras)
@@ -0,0 +1,42 @@
+import asyncio
+import threading
+import aiohttp
+
+_lock = threading.Lock()
+_loop = None
+_loop_thread = None
+_sessions = {}
+
+
+def get_loop():
+    """Return the background event loop that drives every async LLM request."""
+    global _loop, _loop_thread
+    with _lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(
+                target=_loop.run_forever, name="autosurvey-aio", daemon=True
+            )
+            _loop_thread.start()
+        return _loop
+
+
+def run_sync(coro):
+    """Run `coro` on the background loop and block the calling thread for the result."""
+    loop = get_loop()
+    if threading.current_thread() is _loop_thread:
+        coro.close()
+        raise RuntimeError("run_sync() can not be called from the event loop thread")
+    return asyncio.run_coroutine_threadsafe(coro, loop).result()
+
+
+def get_async_session(api_url, limit):
+    """Return the aiohttp session for `api_url` bound to the running loop."""
+    loop = asyncio.get_running_loop()
+    key = (id(loop), api_url)
+    session = _sessions.get(key)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(limit=limit, keepalive_timeout=60)
+        session = aiohttp.ClientSession(connector=connector)
+        _sessions[key] = session
+    return session
@@ -0,0 +1,228 @@
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from urllib.parse import urlparse
+from .session import get_session
+
+DONE_STATUSES = ("completed", "expired")
+FAILED_STATUSES = ("failed", "cancelled", "cancelling")
+CHAT_COMPLETIONS = "/chat/completions"
+
+
+class OpenAIBatchBackend:
+    """Batch API of an OpenAI-compatible provider (/files and /batches).
+
+    `base_url` defaults to `api_url` without its /chat/completions suffix.
+    """
+
+    def __init__(
+        self, api_url, api_key, completion_window="24h", base_url=None
+    ) -> None:
+        url = api_url.rstrip("/")
+        if base_url is None:
+            if not url.endswith(CHAT_COMPLETIONS):
+                raise ValueError(
+                    f"can not derive the Batch API url from {api_url!r}: it does "
+                    f"not end with {CHAT_COMPLETIONS}, pass base_url instead"
+                )
+            # https://host/v1/chat/completions -> https://host/v1
+            base_url = url[: -len(CHAT_COMPLETIONS)]
+        self.base_url = base_url.rstrip("/")
+        # /v1/chat/completions, the endpoint every request of a batch goes to
+        self.endpoint = urlparse(url).path
+        self.api_key = api_key
+        self.completion_window = completion_window
+        self.session = get_session(api_url)
+
+    def __headers(self):
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def submit(self, path):
+        with open(path, "rb") as f:
+            response = self.session.post(
+                f"{self.base_url}/files",
+                headers=self.__headers(),
+                files={"file": (os.path.basename(path), f)},
+                data={"purpose": "batch"},
+                timeout=(10, 300),
+            )
+        response.raise_for_status()
+        response = self.session.post(
+            f"{self.base_url}/batches",
+            headers=self.__headers(),
+            json={
+                "input_file_id": response.json()["id"],
+                "endpoint": self.endpoint,
+                "completion_window": self.completion_window,
+            },
+            timeout=(10, 60),
+        )
+        response.raise_for_status()
+        return response.json()["id"]
+
+    def poll(self, batch_id):
+        """Return (status, output reference or None)."""
+        response = self.session.get(
+            f"{self.base_url}/batches/{batch_id}",
+            headers=self.__headers(),
+            timeout=(10, 60),
+        )
+        response.raise_for_status()
+        batch = response.json()
+        return batch["status"], batch.get("output_file_id")
+
+    def download(self, output):
+        response = self.session.get(
+            f"{self.base_url}/files/{output}/content",
+            headers=self.__headers(),
+            timeout=(10, 300),
+        )
+        response.raise_for_status()
+        return response.text.splitlines()
+
+
+class LocalBatchBackend:
+    """File-based stand-in for a Batch API, for offline runs and tests.
+
+    Each submitted JSONL file is answered in a background thread by
+    `respond(prompt, temperature)`, e.g. the `chat` of an APIModel pointed at
+    a local server, and written to `<directory>/<batch id>/output.jsonl`.
+    """
+
+    endpoint = "/v1/chat/completions"
+
+    def __init__(self, directory, respond, delay=0.0) -> None:
+        self.directory = directory
+        self.respond = respond
+        # simulated queueing time before the batch is processed
+        self.delay = delay
+        self.__ids = itertools.count(1)
+
+    def __dir(self, batch_id):
+        return os.path.join(self.directory, batch_id)
+
+    def __set_status(self, batch_id, status):
+        path = os.path.join(self.__dir(batch_id), "status.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump({"status": status}, f)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, path):
+        batch_id = f"batch_local_{uuid.uuid4().hex[:8]}_{next(self.__ids)}"
+        os.makedirs(self.__dir(batch_id))
+        with open(path, "r", encoding="utf-8") as f:
+            lines = [line for line in f if line.strip()]
+        self.__set_status(batch_id, "validating")
+        threading.Thread(
+            target=self.__process, args=(batch_id, lines), daemon=True
+        ).start()
+        return batch_id
+
+    def __process(self, batch_id, lines):
+        time.sleep(self.delay)
+        self.__set_status(batch_id, "in_progress")
+        out = []
+        for line in lines:
+            request = json.loads(line)
+            body = request["body"]
+            record = {"id": uuid.uuid4().hex, "custom_id": request["custom_id"]}
+            try:
+                content = self.respond(
+                    body["messages"][-1]["content"], body.get("temperature", 1)
+                )
+                record["response"] = {
+                    "status_code": 200,
+                    "body": {
+                        "model": body.get("model"),
+                        "choices": [
+                            {
+                                "index": 0,
+                                "message": {"role": "assistant", "content": content},
+                            }
+                        ],
+                    },
+                }
+                record["error"] = None
+            except Exception as exc:
+                record["response"] = None
+                record["error"] = {"message": str(exc)}
+            out.append(json.dumps(record, ensure_ascii=False))
+        with open(os.path.join(self.__dir(batch_id), "output.jsonl"), "w") as f:
+            f.write("\n".join(out) + "\n")
+        self.__set_status(batch_id, "completed")
+
+    def poll(self, batch_id):
+        with open(os.path.join(self.__dir(batch_id), "status.json"), "r") as f:
+            status = json.load(f)["status"]
+        return status, batch_id if status == "completed" else None
+
+    def download(self, output):
+        path = os.path.join(self.__dir(output), "output.jsonl")
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+
+class BatchRunner:
+    """Write requests to JSONL, submit them, poll and map results back in order."""
+
+    def __init__(
+        self, backend, directory, poll_interval=30.0, timeout=86400.0
+    ) -> None:
+        self.backend = backend
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.batches = []
+
+    def run(self, bodies):
+        """Return one (content, usage) per request body, (None, None) if it failed."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"requests_{uuid.uuid4().hex[:8]}.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for i, body in enumerate(bodies):
+                request = {
+                    "custom_id": f"request-{i}",
+                    "method": "POST",
+                    "url": self.backend.endpoint,
+                    "body": body,
+                }
+                f.write(json.dumps(request, ensure_ascii=False) + "\n")
+        start = time.time()
+        batch_id = self.backend.submit(path)
+        while True:
+            status, output = self.backend.poll(batch_id)
+            if status in DONE_STATUSES or status in FAILED_STATUSES:
+                break
+            if time.time() - start > self.timeout:
+                raise TimeoutError(
+                    f"batch {batch_id} still {status} after {self.timeout}s"
+                )
+            time.sleep(self.poll_interval)
+        self.batches.append(
+            {
+                "id": batch_id,
+                "requests": len(bodies),
+                "status": status,
+                "elapsed": time.time() - start,
+            }
+        )
+        if status in FAILED_STATUSES:
+            raise RuntimeError(f"batch {batch_id} ended as {status}")
+        results = [(None, None)] * len(bodies)
+        # an expired batch may still have answered part of the requests
+        for line in self.backend.download(output) if output else []:
+            record = json.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") != 200:
+                continue
+            body = response["body"]
+            idx = int(record["custom_id"].split("-")[-1])
+            content = body["choices"][0]["message"]["content"]
+            results[idx] = (content, body.get("usage"))
+        return results
+
+    def stats(self):
+        return list(self.batches)
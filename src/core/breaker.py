@@ -0,0 +1,141 @@
+import threading
+import time
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of sending a request while the circuit is open."""
+
+    def __init__(self, retry_in) -> None:
+        super().__init__(
+            f"LLM endpoint unavailable, circuit open (next probe in {retry_in:.0f}s)"
+        )
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """Stop calling a provider that is down instead of retrying every request.
+
+    closed: requests flow; `failure_threshold` failed attempts in a row
+    (connection errors or 5xx) open the circuit.
+    open: requests fail fast with CircuitOpenError for `recovery_time`
+    seconds, doubling up to `max_recovery_time` while probes keep failing.
+    half-open: up to `probes` requests go through; `success_threshold`
+    successes close the circuit, one failure opens it again.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(
+        self,
+        failure_threshold=5,
+        recovery_time=30.0,
+        max_recovery_time=300.0,
+        probes=1,
+        success_threshold=1,
+        max_wait=900.0,
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.max_recovery_time = max_recovery_time
+        self.probes = probes
+        self.success_threshold = success_threshold
+        # how long `wait` pauses callers before giving up
+        self.max_wait = max_wait
+        self.state = self.CLOSED
+        self.failures = 0
+        self.successes = 0
+        self.probing = 0
+        self.trips = 0
+        self.opened_until = 0.0
+        self.rejected = 0
+        self.history = []
+        self.__lock = threading.Lock()
+
+    def __transition(self, state):
+        self.state = state
+        self.history.append({"time": time.time(), "state": state})
+        del self.history[:-100]
+
+    def __try_allow(self):
+        """Return (allowed, probe, retry_in); call with the lock held."""
+        now = time.time()
+        if self.state == self.OPEN:
+            if now < self.opened_until:
+                return False, False, self.opened_until - now
+            self.__transition(self.HALF_OPEN)
+            self.successes, self.probing = 0, 0
+        if self.state == self.HALF_OPEN:
+            if self.probing >= self.probes:
+                return False, False, 1.0
+            self.probing += 1
+            return True, True, 0.0
+        return True, False, 0.0
+
+    def before(self):
+        """Admit an attempt or raise CircuitOpenError; True if it is a probe."""
+        with self.__lock:
+            allowed, probe, retry_in = self.__try_allow()
+            if not allowed:
+                self.rejected += 1
+                raise CircuitOpenError(retry_in)
+            return probe
+
+    def try_before(self):
+        """Non-raising `before`: (allowed, probe, retry_in)."""
+        with self.__lock:
+            return self.__try_allow()
+
+    def wait(self):
+        """Like `before`, but pause until the circuit admits us (up to max_wait)."""
+        deadline = time.time() + self.max_wait
+        while True:
+            with self.__lock:
+                allowed, probe, retry_in = self.__try_allow()
+            if allowed:
+                return probe
+            if time.time() + min(retry_in, 1.0) > deadline:
+                with self.__lock:
+                    self.rejected += 1
+                raise CircuitOpenError(retry_in)
+            time.sleep(min(retry_in, 1.0))
+
+    def after(self, probe, ok, status=None, cancelled=False):
+        """Report the outcome of an admitted attempt."""
+        # throttling and client errors say nothing about the provider being down
+        failed = not ok and (status is None or status >= 500)
+        with self.__lock:
+            if probe:
+                self.probing -= 1
+            if cancelled or self.state == self.OPEN:
+                return
+            if ok:
+                self.failures = 0
+                if self.state == self.HALF_OPEN:
+                    self.successes += 1
+                    if self.successes >= self.success_threshold:
+                        self.trips = 0
+                        self.__transition(self.CLOSED)
+            elif failed:
+                self.failures += 1
+                if self.state == self.HALF_OPEN or (
+                    self.failures >= self.failure_threshold
+                ):
+                    self.__open()
+
+    def __open(self):
+        self.trips += 1
+        self.failures = 0
+        recovery = self.recovery_time * 2 ** min(self.trips - 1, 10)
+        self.opened_until = time.time() + min(recovery, self.max_recovery_time)
+        self.__transition(self.OPEN)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "state": self.state,
+                "failures": self.failures,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_in": max(self.opened_until - time.time(), 0.0),
+                "history": list(self.history),
+            }
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+_lock = threading.Lock()
+_caches = {}
+
+
+def request_key(model, text, params):
+    """Stable key of a chat request: model, prompt hash and generation parameters."""
+    prompt_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    raw = json.dumps([model, prompt_hash, params], sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """SQLite-backed prompt -> response cache with size and age based LRU eviction."""
+
+    def __init__(
+        self,
+        path,
+        max_entries=20000,
+        max_bytes=512 * 1024 * 1024,
+        max_age=7 * 24 * 3600,
+        cache_sampled=True,
+        evict_every=50,
+    ) -> None:
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # set to False to never cache calls made with temperature > 0
+        self.cache_sampled = cache_sampled
+        self.evict_every = evict_every
+        self.hits, self.misses, self.skipped = 0, 0, 0
+        self.__puts = 0
+        self.__lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.__conn = sqlite3.connect(path, check_same_thread=False)
+        with self.__lock:
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, size INTEGER, "
+                "created REAL, accessed REAL)"
+            )
+            self.__conn.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)"
+            )
+            self.__conn.commit()
+
+    def accepts(self, temperature):
+        if temperature and temperature > 0 and not self.cache_sampled:
+            with self.__lock:
+                self.skipped += 1
+            return False
+        return True
+
+    def get(self, key):
+        now = time.time()
+        with self.__lock:
+            row = self.__conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.max_age and now - row[1] > self.max_age:
+                self.__conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.__conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.__conn.execute(
+                "UPDATE responses SET accessed = ? WHERE key = ?", (now, key)
+            )
+            self.__conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, model, response):
+        if response is None:
+            return
+        now = time.time()
+        with self.__lock:
+            self.__conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self.__conn.commit()
+            self.__puts += 1
+            if self.__puts % self.evict_every == 0:
+                self.__evict()
+
+    def __evict(self):
+        if self.max_age:
+            self.__conn.execute(
+                "DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,)
+            )
+        count, size = self.__conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if count > self.max_entries or size > self.max_bytes:
+            # drop least recently used rows until both limits hold again
+            rows = self.__conn.execute(
+                "SELECT key, size FROM responses ORDER BY accessed ASC"
+            ).fetchall()
+            stale = []
+            for key, row_size in rows:
+                if count <= self.max_entries and size <= self.max_bytes:
+                    break
+                stale.append((key,))
+                count -= 1
+                size -= row_size
+            self.__conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+        self.__conn.commit()
+
+    def evict(self):
+        with self.__lock:
+            self.__evict()
+
+    def clear(self):
+        with self.__lock:
+            self.__conn.execute("DELETE FROM responses")
+            self.__conn.commit()
+
+    def stats(self):
+        with self.__lock:
+            count, size = self.__conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            lookups = self.hits + self.misses
+            return {
+                "path": self.path,
+                "entries": count,
+                "bytes": size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+def get_cache(path, **kwargs):
+    """Return the cache shared by every APIModel using the database at `path`."""
+    path = os.path.abspath(path)
+    with _lock:
+        cache = _caches.get(path)
+        if cache is None:
+            cache = ResponseCache(path, **kwargs)
+            _caches[path] = cache
+        return cache
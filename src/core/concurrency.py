@@ -0,0 +1,153 @@
+import threading
+import time
+from collections import deque
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+def overloaded(ok, status):
+    """True for a failure that says the endpoint is overloaded or down:
+    throttling (429), server errors (5xx) and timeouts or connection errors
+    (no status). Other client errors say nothing about its capacity."""
+    return not ok and (status is None or status == 429 or status >= 500)
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit for LLM calls.
+
+    The limit grows by `increase` after a full window of healthy calls and is
+    multiplied by `decrease` on throttling (429), server errors (5xx), timeouts
+    or when latency rises above `latency_tolerance` times the best latency seen
+    so far. Other failed calls, such as a 400 or 401, leave the limit as it is.
+    """
+
+    def __init__(
+        self,
+        initial=5,
+        min_limit=1,
+        max_limit=32,
+        increase=1,
+        decrease=0.5,
+        latency_tolerance=3.0,
+        history_size=256,
+    ) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.in_flight = 0
+        self.latency_ewma = None
+        self.latency_baseline = None
+        self.history = deque(maxlen=history_size)
+        self.__successes = 0
+        self.__last_decrease = 0.0
+        self.__cond = threading.Condition()
+        self.__record("init")
+
+    def __record(self, reason):
+        self.history.append(
+            {"time": time.time(), "limit": int(self.limit), "reason": reason}
+        )
+
+    def try_acquire(self):
+        with self.__cond:
+            if self.in_flight < int(self.limit):
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self):
+        with self.__cond:
+            while self.in_flight >= int(self.limit):
+                self.__cond.wait()
+            self.in_flight += 1
+
+    def cancel(self):
+        """Give a slot back without feedback, e.g. for an abandoned hedge."""
+        with self.__cond:
+            self.in_flight -= 1
+            self.__cond.notify_all()
+
+    def release(self, latency, ok, status=None):
+        with self.__cond:
+            self.in_flight -= 1
+            if ok:
+                self.__observe_latency(latency)
+            if overloaded(ok, status):
+                self.__on_failure(f"status {status}" if status else "error")
+            elif not ok:
+                # a rejected request (400, 401, ...) neither grows nor shrinks it
+                pass
+            elif (
+                self.latency_baseline is not None
+                and self.latency_ewma > self.latency_baseline * self.latency_tolerance
+            ):
+                self.__on_failure("latency")
+            else:
+                self.__on_success()
+            self.__cond.notify_all()
+
+    def __observe_latency(self, latency):
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = 0.8 * self.latency_ewma + 0.2 * latency
+        if self.latency_baseline is None or self.latency_ewma < self.latency_baseline:
+            self.latency_baseline = self.latency_ewma
+
+    def __on_success(self):
+        self.__successes += 1
+        if self.__successes >= int(self.limit) and self.limit < self.max_limit:
+            self.limit = min(self.limit + self.increase, self.max_limit)
+            self.__successes = 0
+            self.__record("increase")
+
+    def __on_failure(self, reason):
+        self.__successes = 0
+        # calls already in flight fail together; back off once per latency window
+        now = time.time()
+        if now - self.__last_decrease < (self.latency_ewma or 1.0):
+            return
+        self.__last_decrease = now
+        limit = max(self.limit * self.decrease, self.min_limit)
+        if limit < self.limit:
+            self.limit = limit
+            self.__record(f"decrease: {reason}")
+        if reason == "latency":
+            # let the baseline follow a provider that became slower for good
+            self.latency_baseline = self.latency_ewma / self.latency_tolerance
+
+    def widen(self, max_limit):
+        """Let the limit grow up to `max_limit` if that is above the current cap."""
+        with self.__cond:
+            if max_limit > self.max_limit:
+                self.max_limit = max_limit
+                self.__record("max_limit")
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "limit": int(self.limit),
+                "in_flight": self.in_flight,
+                "latency_ewma": self.latency_ewma,
+                "latency_baseline": self.latency_baseline,
+                "history": list(self.history),
+            }
+
+
+def get_limiter(key, **kwargs):
+    """Return the limiter shared by every APIModel registered under `key`.
+
+    A larger `max_limit` than the registered one raises its cap.
+    """
+    with _lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = AdaptiveLimiter(**kwargs)
+            _limiters[key] = limiter
+        elif kwargs.get("max_limit") is not None:
+            limiter.widen(kwargs["max_limit"])
+        return limiter
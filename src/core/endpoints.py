@@ -0,0 +1,149 @@
+import threading
+import time
+from .session import get_session, pool_stats
+from .concurrency import get_limiter, overloaded
+from .ratelimit import get_rate_limiter
+
+
+class Endpoint:
+    """One OpenAI-compatible chat endpoint with its key, weight and limits."""
+
+    def __init__(
+        self,
+        api_url,
+        api_key,
+        weight=1.0,
+        max_concurrency=32,
+        initial_concurrency=5,
+        rpm=None,
+        tpm=None,
+    ) -> None:
+        self.api_url = api_url
+        self.api_key = api_key
+        self.weight = weight
+        self.max_concurrency = max_concurrency
+        # AIMD limit shared by every agent (and APIModel) using this url and key
+        self.limiter = get_limiter(
+            (api_url, api_key),
+            initial=min(initial_concurrency, max_concurrency),
+            max_limit=max_concurrency,
+        )
+        # keep-alive connections are shared with every APIModel on the same url
+        self.session = get_session(api_url, pool_maxsize=max_concurrency)
+        # RPM/TPM budget shared by every APIModel using this url and key
+        self.rate_limiter = None
+        if rpm or tpm:
+            self.rate_limiter = get_rate_limiter(api_url, api_key, rpm=rpm, tpm=tpm)
+        self.outstanding = 0
+        self.requests, self.errors, self.ejections = 0, 0, 0
+        self.consecutive_errors = 0
+        self.ejected_until = 0.0
+
+    @classmethod
+    def from_config(cls, config, **defaults):
+        """Build an endpoint from a config.json entry such as
+        {"API_URL": ..., "API_KEY": ..., "WEIGHT": 2, "MAX_CONCURRENCY": 16}."""
+        kwargs = dict(defaults)
+        for key, name in (
+            ("WEIGHT", "weight"),
+            ("MAX_CONCURRENCY", "max_concurrency"),
+            ("RPM", "rpm"),
+            ("TPM", "tpm"),
+        ):
+            if config.get(key) is not None:
+                kwargs[name] = config[key]
+        return cls(config["API_URL"], config["API_KEY"], **kwargs)
+
+    def stats(self):
+        return {
+            "api_url": self.api_url,
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "ejected": time.time() < self.ejected_until,
+            "limit": self.limiter.stats()["limit"],
+            "pool": pool_stats(self.api_url),
+        }
+
+
+class EndpointPool:
+    """Spread requests over endpoints by weighted least-outstanding-requests.
+
+    An endpoint that fails `max_errors` times in a row is ejected for
+    `ejection_time` seconds (doubling on repeated ejections); client errors
+    other than 429 do not count. If every
+    endpoint is ejected they are all tried again rather than failing here.
+    """
+
+    def __init__(self, endpoints, max_errors=3, ejection_time=30.0) -> None:
+        if not endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.max_errors = max_errors
+        self.ejection_time = ejection_time
+        self.__cond = threading.Condition()
+
+    @property
+    def max_concurrency(self):
+        return sum(e.max_concurrency for e in self.endpoints)
+
+    def try_pick(self):
+        """Return an endpoint holding a concurrency slot, or None if all are busy."""
+        with self.__cond:
+            now = time.time()
+            healthy = [e for e in self.endpoints if now >= e.ejected_until]
+            candidates = healthy or self.endpoints
+            candidates = sorted(candidates, key=lambda e: (e.outstanding + 1) / e.weight)
+            for endpoint in candidates:
+                if endpoint.outstanding >= endpoint.max_concurrency:
+                    continue
+                if endpoint.limiter.try_acquire():
+                    endpoint.outstanding += 1
+                    endpoint.requests += 1
+                    return endpoint
+            return None
+
+    def pick(self):
+        while True:
+            endpoint = self.try_pick()
+            if endpoint is not None:
+                return endpoint
+            # limiters are shared with other APIModels, so poll as well as wait
+            with self.__cond:
+                self.__cond.wait(0.05)
+
+    def release(self, endpoint, latency, ok, status=None, cancelled=False):
+        """Return the slot and report the outcome; True if the endpoint got ejected."""
+        if cancelled:
+            endpoint.limiter.cancel()
+        else:
+            endpoint.limiter.release(latency, ok, status)
+        ejected = False
+        with self.__cond:
+            endpoint.outstanding -= 1
+            if ok:
+                endpoint.consecutive_errors = 0
+            elif not cancelled:
+                endpoint.errors += 1
+            if not cancelled and overloaded(ok, status):
+                endpoint.consecutive_errors += 1
+                if endpoint.consecutive_errors >= self.max_errors:
+                    endpoint.consecutive_errors = 0
+                    endpoint.ejections += 1
+                    backoff = 2 ** min(endpoint.ejections - 1, 4)
+                    endpoint.ejected_until = time.time() + self.ejection_time * backoff
+                    ejected = True
+            self.__cond.notify_all()
+        return ejected
+
+    def has_healthy(self, exclude=None):
+        now = time.time()
+        return any(
+            e is not exclude and now >= e.ejected_until for e in self.endpoints
+        )
+
+    def stats(self):
+        with self.__cond:
+            return [e.stats() for e in self.endpoints]
@@ -0,0 +1,63 @@
+import threading
+from collections import deque
+
+
+class HedgePolicy:
+    """When to send a duplicate request for a slow call, and how many of them.
+
+    A hedge is sent once a call has been running for longer than the
+    `percentile` of recent latencies. Hedges are capped at `max_extra` times
+    the number of calls, so hedging never adds more than that share of load.
+    """
+
+    def __init__(
+        self, percentile=0.95, max_extra=0.1, min_samples=20, window=200, min_delay=1.0
+    ) -> None:
+        self.percentile = percentile
+        self.max_extra = max_extra
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.latencies = deque(maxlen=window)
+        self.calls, self.hedges = 0, 0
+        self.wins, self.losses, self.denied = 0, 0, 0
+        self.__lock = threading.Lock()
+
+    def observe(self, latency):
+        with self.__lock:
+            self.latencies.append(latency)
+
+    def delay(self):
+        """Seconds to wait before hedging a new call, None while warming up."""
+        with self.__lock:
+            self.calls += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        idx = min(int(len(latencies) * self.percentile), len(latencies) - 1)
+        return max(latencies[idx], self.min_delay)
+
+    def try_hedge(self):
+        with self.__lock:
+            if self.hedges + 1 > self.max_extra * self.calls:
+                self.denied += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def record(self, hedge_won):
+        with self.__lock:
+            if hedge_won:
+                self.wins += 1
+            else:
+                self.losses += 1
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "calls": self.calls,
+                "hedges": self.hedges,
+                "hedge_wins": self.wins,
+                "hedge_losses": self.losses,
+                "denied": self.denied,
+                "extra_load": self.hedges / self.calls if self.calls else 0.0,
+            }
@@ -1,60 +1,646 @@
-import requests
+import asyncio
+import copy
 import json
+import time
+import weakref
+import aiohttp
 from tqdm import tqdm
 import concurrent.futures
+from .session import pool_stats
+from .aio import get_async_session, run_sync
+from .retry import CallLog, RetryPolicy, parse_retry_after
+from .cache import request_key
+from .singleflight import SingleFlight
+from .endpoints import Endpoint, EndpointPool
+from .scheduler import get_scheduler
+from .breaker import CircuitOpenError
+from .profiles import load_profiles
+from .usage import UsageCounter
+
+
+def _token_counter():
+    # core/ is imported within the node package and as top-level `core` (see
+    # agents/judge.py), where `..utils` lies beyond the package
+    try:
+        from ..utils.utils import tokenCounter
+    except ImportError:
+        from utils.utils import tokenCounter
+    return tokenCounter()
 
 
 class APIModel:
 
-    def __init__(self, model, api_key, api_url) -> None:
-        self.__api_key = api_key
-        self.__api_url = api_url
+    def __init__(
+        self,
+        model,
+        api_key,
+        api_url,
+        max_workers=5,
+        max_concurrency=None,
+        use_async=False,
+        retry_policy=None,
+        cache=None,
+        dedupe=True,
+        rpm=None,
+        tpm=None,
+        completion_tokens_estimate=1000,
+        endpoints=None,
+        max_errors=3,
+        ejection_time=30.0,
+        hedge=None,
+        scheduler=None,
+        job="default",
+        stage=None,
+        breaker=None,
+        on_open="fail",
+        batch=None,
+        profiles=None,
+        probe_ttl=300.0,
+    ) -> None:
         self.model = model
+        self.max_workers = max_workers
+        if not endpoints:
+            endpoints = [
+                Endpoint(
+                    api_url,
+                    api_key,
+                    max_concurrency=max_concurrency or max(max_workers, 32),
+                    initial_concurrency=max_workers,
+                    rpm=rpm,
+                    tpm=tpm,
+                )
+            ]
+        # requests are spread over the endpoints, failing ones are ejected for a while
+        self.endpoints = EndpointPool(
+            endpoints, max_errors=max_errors, ejection_time=ejection_time
+        )
+        # upper bound of in-flight requests, shared by all callers
+        self.max_concurrency = self.endpoints.max_concurrency
+        # route chat/batch_chat through the async client
+        self.use_async = use_async
+        self.__semaphores = weakref.WeakKeyDictionary()
+        self.retry_policy = retry_policy or RetryPolicy()
+        # retries and backoff time of every call, to explain tail latency
+        self.call_log = CallLog()
+        # optional ResponseCache shared across runs
+        self.cache = cache
+        # identical requests in flight at the same time are sent only once
+        self.dedupe = dedupe
+        self.flights = SingleFlight()
+        self.completion_tokens_estimate = completion_tokens_estimate
+        # provider-reported token usage per stage and per job, shared with views
+        self.usage = UsageCounter()
+        self.__token_counter = None
+        # optional HedgePolicy: duplicate calls slower than recent tail latency
+        self.hedge = hedge
+        # threads start on demand; created here so that views share it
+        self.__hedge_executor = None
+        if hedge is not None:
+            self.__hedge_executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency * 2, thread_name_prefix="hedge"
+            )
+        # process-wide priority/fair-share admission, see with_options
+        self.scheduler = scheduler or get_scheduler()
+        self.job = job
+        self.stage = stage
+        # optional CircuitBreaker; while open calls fail fast ("fail") or pause ("wait")
+        self.breaker = breaker
+        self.on_open = on_open
+        # optional BatchRunner used by bulk_chat for latency-insensitive work
+        self.batch = batch
+        # GenerationProfile per stage: temperature, max_tokens and stop strings
+        self.profiles = profiles if profiles is not None else load_profiles()
+        # seconds a successful health check probe stays valid, see core/probe.py
+        self.probe_ttl = probe_ttl
+
+    def with_options(
+        self, stage=None, job=None, on_open=None, max_tokens=None, fresh=False
+    ):
+        """A view of this model whose calls run as `job` in `stage`.
+
+        `max_tokens` raises the stage profile's cap to at least that many
+        tokens; `fresh` skips the response cache and request deduplication,
+        for calls that must reach an endpoint. The view shares endpoints,
+        limits, cache and statistics with this model.
+        """
+        view = copy.copy(self)
+        if stage is not None:
+            view.stage = stage
+        if job is not None:
+            view.job = job
+        if on_open is not None:
+            view.on_open = on_open
+        if fresh:
+            view.cache = None
+            view.dedupe = False
+        profile = view.profiles.get(view.stage)
+        if (
+            max_tokens is not None
+            and profile is not None
+            and profile.max_tokens is not None
+            and profile.max_tokens < max_tokens
+        ):
+            view.profiles = {
+                **view.profiles,
+                view.stage: profile.with_max_tokens(max_tokens),
+            }
+        return view
 
-    def __req(self, text, temperature, max_try=5):
-        url = f"{self.__api_url}"
+    def __payload(self, text, temperature, stream=False):
+        return json.dumps(self.__body(text, temperature, stream=stream))
+
+    def __params(self, temperature):
+        """Sampling parameters of a request; they are part of cache keys too."""
+        params = {"temperature": temperature}
+        profile = self.profiles.get(self.stage)
+        if profile is not None:
+            params.update(profile.params())
+        return params
+
+    def __temperature(self, temperature, default):
+        if temperature is not None:
+            return temperature
+        profile = self.profiles.get(self.stage)
+        if profile is not None and profile.temperature is not None:
+            return profile.temperature
+        return default
+
+    def __body(self, text, temperature, stream=False):
         pay_load_dict = {
             "model": f"{self.model}",
-            "messages": [
-                {"role": "user", "temperature": temperature, "content": f"{text}"}
-            ],
+            "messages": [{"role": "user", "content": f"{text}"}],
+            **self.__params(temperature),
         }
-        payload = json.dumps(pay_load_dict)
-        headers = {
+        if stream:
+            pay_load_dict["stream"] = True
+            # ask for the usage block in the final chunk
+            pay_load_dict["stream_options"] = {"include_usage": True}
+        return pay_load_dict
+
+    def __headers(self, endpoint):
+        return {
             "Accept": "application/json",
-            "Authorization": f"Bearer {self.__api_key}",
+            "Authorization": f"Bearer {endpoint.api_key}",
             "User-Agent": "Apifox/1.0.0 (https://apifox.com)",
             "Content-Type": "application/json",
         }
+
+    def __remaining(self, start):
+        if self.retry_policy.deadline is None:
+            return None
+        return self.retry_policy.deadline - (time.time() - start)
+
+    def __next_delay(self, start, retries, max_try, status, retry_after, failover):
+        """Backoff before the next attempt, or None when the call should give up."""
+        policy = self.retry_policy
+        if retries >= max_try or not policy.should_retry(status):
+            return None
+        # the failing endpoint was just ejected, fail over to another one at once
+        if failover:
+            return 0.0
+        delay = policy.backoff(retries, retry_after)
+        remaining = self.__remaining(start)
+        if remaining is not None and delay >= remaining:
+            return None
+        return delay
+
+    def __count_tokens(self, text):
+        if self.__token_counter is None:
+            self.__token_counter = _token_counter()
+        return self.__token_counter.num_tokens_from_string(text or "")
+
+    def __token_budgeted(self):
+        # only a TPM budget needs prompt estimates, skip tokenization otherwise
+        return any(
+            e.rate_limiter is not None and e.rate_limiter.tokens
+            for e in self.endpoints.endpoints
+        )
+
+    def __prompt_tokens(self, text):
+        if self.__token_budgeted():
+            return self.__count_tokens(text)
+        return 0
+
+    def __count_batch(self, text_batch):
+        """Tokenize the prompts of a batch in one parallel call.
+
+        The counts land in the shared memo, so the per-request estimates hit it.
+        """
+        if self.__token_budgeted() and text_batch:
+            if self.__token_counter is None:
+                self.__token_counter = _token_counter()
+            self.__token_counter.num_tokens_from_strings(list(text_batch))
+
+    def __enter_circuit(self):
+        """Let the breaker admit an attempt; returns whether it is a probe."""
+        if self.breaker is None:
+            return False
+        if self.on_open == "wait":
+            return self.breaker.wait()
+        return self.breaker.before()
+
+    async def __aenter_circuit(self):
+        if self.breaker is None:
+            return False
+        if self.on_open != "wait":
+            return self.breaker.before()
+        deadline = time.time() + self.breaker.max_wait
+        while True:
+            allowed, probe, retry_in = self.breaker.try_before()
+            if allowed:
+                return probe
+            if time.time() + min(retry_in, 1.0) > deadline:
+                raise CircuitOpenError(retry_in)
+            await asyncio.sleep(min(retry_in, 1.0))
+
+    def __admit(self, prompt_tokens):
+        """Pass the breaker and the scheduler, take an endpoint slot and budget.
+
+        Returns (endpoint, reservation, probe).
+        """
+        probe = self.__enter_circuit()
+        endpoint = self.scheduler.acquire(
+            self.job, self.stage, admit=self.endpoints.try_pick, pool=self.endpoints
+        )
+        if endpoint.rate_limiter is None:
+            return endpoint, None, probe
+        return (
+            endpoint,
+            endpoint.rate_limiter.reserve(
+                prompt_tokens + self.completion_tokens_estimate
+            ),
+            probe,
+        )
+
+    async def __aadmit(self, prompt_tokens):
+        probe = await self.__aenter_circuit()
+        endpoint = None
         try:
-            response = requests.request("POST", url, headers=headers, data=payload)
-            return json.loads(response.text)["choices"][0]["message"]["content"]
-        except:  # noqa: E722
-            for _ in range(max_try):
-                try:
-                    response = requests.request(
-                        "POST", url, headers=headers, data=payload
+            endpoint = await self.scheduler.aacquire(
+                self.job,
+                self.stage,
+                admit=self.endpoints.try_pick,
+                pool=self.endpoints,
+            )
+            if endpoint.rate_limiter is None:
+                return endpoint, None, probe
+            while True:
+                reservation, wait = endpoint.rate_limiter.try_reserve(
+                    prompt_tokens + self.completion_tokens_estimate
+                )
+                if reservation is not None:
+                    return endpoint, reservation, probe
+                await asyncio.sleep(wait)
+        except asyncio.CancelledError:
+            if endpoint is not None:
+                self.endpoints.release(endpoint, 0.0, False, cancelled=True)
+                self.scheduler.release(self.job)
+            if self.breaker is not None:
+                self.breaker.after(probe, False, cancelled=True)
+            raise
+
+    def __finish(
+        self,
+        endpoint,
+        reservation,
+        latency,
+        ok,
+        status,
+        text,
+        prompt_tokens,
+        usage,
+        content,
+        probe=False,
+        cancelled=False,
+    ):
+        """Release the endpoint slot, record usage and settle the budget.
+
+        Returns True when the caller should fail over to another endpoint.
+        """
+        ejected = self.endpoints.release(
+            endpoint, latency, ok, status, cancelled=cancelled
+        )
+        self.scheduler.release(self.job)
+        if self.breaker is not None:
+            self.breaker.after(probe, ok, status, cancelled=cancelled)
+        used = 0
+        if content is not None:
+            used = sum(self.__record_usage(text, prompt_tokens, usage, content))
+        if reservation is not None:
+            endpoint.rate_limiter.settle(reservation, used)
+        return ejected and self.endpoints.has_healthy(exclude=endpoint)
+
+    def __truncated(self, finish_reason):
+        """True when the completion stopped at max_tokens and is likely cut off."""
+        if finish_reason != "length":
+            return False
+        max_tokens = self.__params(None).get("max_tokens")
+        print(
+            f"Warning: {self.stage} completion of {self.job} stopped at "
+            f"max_tokens={max_tokens} and is probably incomplete"
+        )
+        return True
+
+    def __record_usage(self, text, prompt_tokens, usage, content):
+        """Count the reported usage; tokenize locally only when it is missing."""
+        usage = usage or {}
+        prompt = usage.get("prompt_tokens")
+        completion = usage.get("completion_tokens")
+        estimated = prompt is None or completion is None
+        if prompt is None:
+            prompt = prompt_tokens or self.__count_tokens(text)
+        if completion is None:
+            completion = self.__count_tokens(content)
+        self.usage.add(self.stage, self.job, prompt, completion, estimated=estimated)
+        return prompt, completion
+
+    def __req(self, text, temperature, max_try=None):
+        if max_try is None:
+            max_try = self.retry_policy.max_retries
+        payload = self.__payload(text, temperature)
+        prompt_tokens = self.__prompt_tokens(text)
+        start, retries, wait = time.time(), 0, 0.0
+        while True:
+            endpoint, reservation, probe = self.__admit(prompt_tokens)
+            attempt_start, status, retry_after, ok = time.time(), None, None, False
+            body, truncated = None, False
+            try:
+                response = endpoint.session.post(
+                    endpoint.api_url,
+                    headers=self.__headers(endpoint),
+                    data=payload,
+                    timeout=self.retry_policy.timeout(self.__remaining(start)),
+                )
+                status = response.status_code
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                body = json.loads(response.text)
+                choice = body["choices"][0]
+                content = choice["message"]["content"]
+                truncated = self.__truncated(choice.get("finish_reason"))
+                ok = True
+            except Exception:
+                content = None
+            finally:
+                failover = self.__finish(
+                    endpoint,
+                    reservation,
+                    time.time() - attempt_start,
+                    ok,
+                    status,
+                    text,
+                    prompt_tokens,
+                    body.get("usage") if isinstance(body, dict) else None,
+                    content,
+                    probe=probe,
+                )
+            delay = None
+            if not ok:
+                delay = self.__next_delay(
+                    start, retries, max_try, status, retry_after, failover
+                )
+            if delay is None:
+                break
+            time.sleep(delay)
+            retries += 1
+            wait += delay
+        self.call_log.add(
+            retries=retries,
+            wait=wait,
+            elapsed=time.time() - start,
+            status=status,
+            ok=ok,
+            truncated=truncated,
+        )
+        return content
+
+    @staticmethod
+    def __iter_sse(lines, usage=None, finish=None):
+        """Yield content deltas; a usage block, if sent, is copied into `usage`
+        and the finish_reason into `finish["reason"]`."""
+        for line in lines:
+            if isinstance(line, bytes):
+                line = line.decode("utf-8")
+            line = line.strip()
+            if not line.startswith("data:"):
+                continue
+            data = line[len("data:") :].strip()
+            if data == "[DONE]":
+                break
+            event = json.loads(data)
+            if usage is not None and event.get("usage"):
+                usage.update(event["usage"])
+            choices = event.get("choices") or [{}]
+            if finish is not None and choices[0].get("finish_reason"):
+                finish["reason"] = choices[0]["finish_reason"]
+            delta = (choices[0].get("delta") or {}).get("content")
+            if delta:
+                yield delta
+
+    def stream_chat(self, text, temperature=None, stage=None, job=None):
+        """Yield the completion of `text` chunk by chunk as the server sends it.
+
+        Failures before the first chunk are retried like `chat`; once text has
+        been yielded an error is raised to the consumer instead.
+        """
+        if stage is not None or job is not None:
+            yield from self.with_options(stage, job).stream_chat(text, temperature)
+            return
+        temperature = self.__temperature(temperature, 1)
+        max_try = self.retry_policy.max_retries
+        payload = self.__payload(text, temperature, stream=True)
+        prompt_tokens = self.__prompt_tokens(text)
+        start, retries, wait, ttft = time.time(), 0, 0.0, None
+        received = []
+        while True:
+            endpoint, reservation, probe = self.__admit(prompt_tokens)
+            attempt_start, status, retry_after, ok = time.time(), None, None, False
+            usage, finish = {}, {}
+            cancelled, truncated = False, False
+            try:
+                with endpoint.session.post(
+                    endpoint.api_url,
+                    headers=self.__headers(endpoint),
+                    data=payload,
+                    stream=True,
+                    timeout=self.retry_policy.timeout(self.__remaining(start)),
+                ) as response:
+                    status = response.status_code
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    response.raise_for_status()
+                    # decode raw lines ourselves, SSE responses rarely declare a charset
+                    lines = response.iter_lines()
+                    for delta in self.__iter_sse(lines, usage, finish):
+                        if ttft is None:
+                            ttft = time.time() - start
+                        received.append(delta)
+                        yield delta
+                ok = True
+                truncated = self.__truncated(finish.get("reason"))
+            except GeneratorExit:
+                # the consumer stopped reading: neither a success nor an error
+                cancelled = True
+                raise
+            except Exception:
+                if ttft is not None:
+                    raise
+            finally:
+                failover = self.__finish(
+                    endpoint,
+                    reservation,
+                    time.time() - attempt_start,
+                    ok,
+                    status,
+                    text,
+                    prompt_tokens,
+                    usage,
+                    "".join(received) or None,
+                    probe=probe,
+                    cancelled=cancelled,
+                )
+                if (ok or ttft is not None) and not cancelled:
+                    self.call_log.add(
+                        retries=retries,
+                        wait=wait,
+                        elapsed=time.time() - start,
+                        status=status,
+                        ok=ok,
+                        ttft=ttft,
+                        truncated=truncated,
                     )
-                    return json.loads(response.text)["choices"][0]["message"]["content"]
-                except:  # noqa: E722
-                    pass
+            if ok:
+                return
+            delay = self.__next_delay(
+                start, retries, max_try, status, retry_after, failover
+            )
+            if delay is None:
+                break
+            time.sleep(delay)
+            retries += 1
+            wait += delay
+        self.call_log.add(
+            retries=retries,
+            wait=wait,
+            elapsed=time.time() - start,
+            status=status,
+            ok=False,
+            ttft=None,
+        )
+
+    def __stream_req(self, text, temperature, on_token):
+        chunks = []
+        for delta in self.stream_chat(text, temperature=temperature):
+            chunks.append(delta)
+            on_token(delta)
+        return "".join(chunks) if chunks else None
+
+    def __cache_key(self, text, temperature):
+        if self.cache is None or not self.cache.accepts(temperature):
             return None
+        return request_key(self.model, text, self.__params(temperature))
 
-    def chat(self, text, temperature=1):
-        response = self.__req(text, temperature=temperature, max_try=5)
+    def __call(self, text, temperature, on_token=None):
+        if not self.dedupe:
+            return self.__fetch(text, temperature, on_token)
+        key = request_key(self.model, text, self.__params(temperature))
+        response, shared = self.flights.do(
+            key, lambda: self.__fetch(text, temperature, on_token)
+        )
+        if shared and on_token is not None and response is not None:
+            on_token(response)
         return response
 
-    def __chat(self, text, temperature, res_l, idx):
+    def __fetch(self, text, temperature, on_token=None):
+        key = self.__cache_key(text, temperature)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                if on_token is not None:
+                    on_token(response)
+                return response
+        if on_token is not None:
+            response = self.__stream_req(text, temperature, on_token)
+        else:
+            response = self.__hedged_req(text, temperature=temperature)
+        if key is not None:
+            self.cache.put(key, self.model, response)
+        return response
 
-        response = self.__req(text, temperature=temperature)
+    def __hedged_req(self, text, temperature):
+        if self.hedge is None:
+            return self.__req(text, temperature=temperature)
+        start = time.time()
+        delay = self.hedge.delay()
+        if delay is None:
+            response = self.__req(text, temperature=temperature)
+            if response is not None:
+                self.hedge.observe(time.time() - start)
+            return response
+        primary = self.__hedge_executor.submit(self.__req, text, temperature)
+        done, _ = concurrent.futures.wait([primary], timeout=delay)
+        if done or not self.hedge.try_hedge():
+            response = primary.result()
+            if response is not None:
+                self.hedge.observe(time.time() - start)
+            return response
+        hedge = self.__hedge_executor.submit(self.__req, text, temperature)
+        pending = {primary, hedge}
+        response = None
+        while pending and response is None:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                if future.result() is not None and response is None:
+                    response = future.result()
+                    # the loser can not be interrupted, it finishes in the background
+                    self.hedge.record(hedge_won=future is hedge)
+                    self.hedge.observe(time.time() - start)
+        return response
+
+    def chat(self, text, temperature=None, on_token=None, stage=None, job=None):
+        """`on_token(delta)` switches to streaming and receives text as it arrives.
+
+        `stage` tags the call for the scheduler and picks its GenerationProfile,
+        whose temperature applies unless one is given; see `with_options`.
+        """
+        if stage is not None or job is not None:
+            return self.with_options(stage, job).chat(text, temperature, on_token)
+        temperature = self.__temperature(temperature, 1)
+        if self.use_async and on_token is None:
+            return run_sync(self.achat(text, temperature=temperature))
+        response = self.__call(text, temperature=temperature, on_token=on_token)
+        return response
+
+    def __chat(self, text, temperature, res_l, idx, on_token=None):
+
+        if on_token is not None:
+            response = self.__call(
+                text, temperature=temperature, on_token=lambda d: on_token(idx, d)
+            )
+        else:
+            response = self.__call(text, temperature=temperature)
         res_l[idx] = response
         return response
 
-    def batch_chat(self, text_batch, temperature=0):
+    def batch_chat(
+        self, text_batch, temperature=None, on_token=None, stage=None, job=None
+    ):
+        """`on_token(idx, delta)` streams every completion of the batch."""
+        if stage is not None or job is not None:
+            view = self.with_options(stage, job)
+            return view.batch_chat(text_batch, temperature, on_token)
+        temperature = self.__temperature(temperature, 0)
+        if self.use_async and on_token is None:
+            return run_sync(self.abatch_chat(text_batch, temperature=temperature))
+        self.__count_batch(text_batch)
         res_l = ["No response"] * len(text_batch)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
+        circuit_open = None
+        # the limiter decides the effective concurrency, the pool only caps it
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=max(min(len(text_batch), self.max_concurrency), 1)
+        ) as executor:
             futures = {
-                executor.submit(self.__chat, text, temperature, res_l, i): i
+                executor.submit(self.__chat, text, temperature, res_l, i, on_token): i
                 for i, text in enumerate(text_batch)
             }
             for future in tqdm(
@@ -63,9 +649,241 @@ class APIModel:
                 idx = futures[future]
                 try:
                     future.result()
+                except CircuitOpenError as exc:
+                    circuit_open = exc
                 except Exception as exc:
                     print(f"Thread {idx} generated an exception: {exc}")
                 else:
                     print(f"Thread {idx} completed successfully")
+        # the rest of the batch failed fast too; let the caller abort or pause
+        if circuit_open is not None:
+            raise circuit_open
+        return res_l
+
+    def bulk_chat(self, text_batch, temperature=None, stage=None, job=None):
+        """Answer a batch through the provider's Batch API when `batch` is set.
+
+        Results come back in order, with "No response" for failed requests.
+        Without a BatchRunner this is `batch_chat`.
+        """
+        if stage is not None or job is not None:
+            return self.with_options(stage, job).bulk_chat(text_batch, temperature)
+        temperature = self.__temperature(temperature, 0)
+        if self.batch is None:
+            return self.batch_chat(text_batch, temperature=temperature)
+        if not text_batch:
+            return []
+        bodies = [self.__body(text, temperature) for text in text_batch]
+        results = self.batch.run(bodies)
+        res_l = []
+        for text, (content, usage) in zip(text_batch, results):
+            if content is None:
+                res_l.append("No response")
+                continue
+            self.__record_usage(text, 0, usage, content)
+            res_l.append(content)
+        return res_l
+
+    def __semaphore(self):
+        # asyncio primitives are bound to a loop, keep one semaphore per loop
+        loop = asyncio.get_running_loop()
+        semaphore = self.__semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__semaphores[loop] = semaphore
+        return semaphore
+
+    async def __areq(self, text, temperature, max_try=None):
+        if max_try is None:
+            max_try = self.retry_policy.max_retries
+        payload = self.__payload(text, temperature)
+        prompt_tokens = self.__prompt_tokens(text)
+        start, retries, wait = time.time(), 0, 0.0
+        while True:
+            endpoint, reservation, probe = await self.__aadmit(prompt_tokens)
+            session = get_async_session(
+                endpoint.api_url, limit=endpoint.max_concurrency
+            )
+            attempt_start, status, retry_after, ok = time.time(), None, None, False
+            body, content, cancelled, truncated = None, None, False, False
+            connect_timeout, read_timeout = self.retry_policy.timeout(
+                self.__remaining(start)
+            )
+            try:
+                async with session.post(
+                    endpoint.api_url,
+                    headers=self.__headers(endpoint),
+                    data=payload,
+                    timeout=aiohttp.ClientTimeout(
+                        sock_connect=connect_timeout, sock_read=read_timeout
+                    ),
+                ) as response:
+                    status = response.status
+                    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                    body = json.loads(await response.text())
+                choice = body["choices"][0]
+                content = choice["message"]["content"]
+                truncated = self.__truncated(choice.get("finish_reason"))
+                ok = True
+            except asyncio.CancelledError:
+                # an abandoned hedge says nothing about the endpoint's health
+                cancelled = True
+                raise
+            except Exception:
+                content = None
+            finally:
+                failover = self.__finish(
+                    endpoint,
+                    reservation,
+                    time.time() - attempt_start,
+                    ok,
+                    status,
+                    text,
+                    prompt_tokens,
+                    body.get("usage") if isinstance(body, dict) else None,
+                    content,
+                    probe=probe,
+                    cancelled=cancelled,
+                )
+            delay = None
+            if not ok:
+                delay = self.__next_delay(
+                    start, retries, max_try, status, retry_after, failover
+                )
+            if delay is None:
+                break
+            await asyncio.sleep(delay)
+            retries += 1
+            wait += delay
+        self.call_log.add(
+            retries=retries,
+            wait=wait,
+            elapsed=time.time() - start,
+            status=status,
+            ok=ok,
+            truncated=truncated,
+        )
+        return content
+
+    async def __ahedged_req(self, text, temperature):
+        if self.hedge is None:
+            return await self.__areq(text, temperature=temperature)
+        start = time.time()
+        delay = self.hedge.delay()
+        primary = asyncio.ensure_future(self.__areq(text, temperature=temperature))
+        if delay is not None:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+        if delay is None or done or not self.hedge.try_hedge():
+            response = await primary
+            if response is not None:
+                self.hedge.observe(time.time() - start)
+            return response
+        hedge = asyncio.ensure_future(self.__areq(text, temperature=temperature))
+        pending = {primary, hedge}
+        response = None
+        while pending and response is None:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                if task.result() is not None and response is None:
+                    response = task.result()
+                    self.hedge.record(hedge_won=task is hedge)
+                    self.hedge.observe(time.time() - start)
+        for task in pending:
+            task.cancel()
+        return response
+
+    async def achat(self, text, temperature=None, stage=None, job=None):
+        if stage is not None or job is not None:
+            return await self.with_options(stage, job).achat(text, temperature)
+        temperature = self.__temperature(temperature, 1)
+        if not self.dedupe:
+            return await self.__afetch(text, temperature)
+        key = request_key(self.model, text, self.__params(temperature))
+        response, _ = await self.flights.ado(
+            key, lambda: self.__afetch(text, temperature)
+        )
+        return response
+
+    async def __afetch(self, text, temperature):
+        key = self.__cache_key(text, temperature)
+        if key is not None:
+            response = self.cache.get(key)
+            if response is not None:
+                return response
+        async with self.__semaphore():
+            response = await self.__ahedged_req(text, temperature=temperature)
+        if key is not None:
+            self.cache.put(key, self.model, response)
+        return response
 
+    async def abatch_chat(self, text_batch, temperature=None, stage=None, job=None):
+        if stage is not None or job is not None:
+            view = self.with_options(stage, job)
+            return await view.abatch_chat(text_batch, temperature)
+        temperature = self.__temperature(temperature, 0)
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.__count_batch, text_batch
+        )
+        results = await asyncio.gather(
+            *[self.achat(text, temperature=temperature) for text in text_batch],
+            return_exceptions=True,
+        )
+        res_l = []
+        for idx, res in enumerate(results):
+            if isinstance(res, CircuitOpenError):
+                raise res
+            if isinstance(res, BaseException):
+                print(f"Request {idx} generated an exception: {res}")
+                res = "No response"
+            res_l.append(res)
         return res_l
+
+    def pool_stats(self):
+        return [p for e in self.endpoints.endpoints for p in pool_stats(e.api_url)]
+
+    def concurrency_stats(self):
+        return {e.api_url: e.limiter.stats() for e in self.endpoints.endpoints}
+
+    def endpoint_stats(self):
+        return self.endpoints.stats()
+
+    def retry_stats(self):
+        return self.call_log.summary()
+
+    def rate_limit_stats(self):
+        return {
+            e.api_url: e.rate_limiter.stats()
+            for e in self.endpoints.endpoints
+            if e.rate_limiter is not None
+        }
+
+    def hedge_stats(self):
+        if self.hedge is None:
+            return None
+        return self.hedge.stats()
+
+    def dedupe_stats(self):
+        return self.flights.stats()
+
+    def batch_stats(self):
+        if self.batch is None:
+            return None
+        return self.batch.stats()
+
+    def breaker_stats(self):
+        if self.breaker is None:
+            return None
+        return self.breaker.stats()
+
+    def usage_stats(self):
+        return self.usage.stats()
+
+    def scheduler_stats(self):
+        return self.scheduler.stats()
+
+    def cache_stats(self):
+        if self.cache is None:
+            return None
+        return self.cache.stats()
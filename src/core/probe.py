@@ -0,0 +1,27 @@
+import threading
+import time
+
+_lock = threading.Lock()
+_probes = {}
+
+
+def probe(model, ttl=None, force=False):
+    """Send a "hello" through `model` unless the same (model, url, key) answered
+    within the last `ttl` seconds, by default `model.probe_ttl`. Returns the
+    (possibly cached) reply."""
+    if ttl is None:
+        ttl = model.probe_ttl
+    endpoint = model.endpoints.endpoints[0]
+    key = (model.model, endpoint.api_url, endpoint.api_key)
+    now = time.time()
+    with _lock:
+        cached = _probes.get(key)
+    if not force and cached is not None and now - cached[0] < ttl:
+        return cached[1]
+    # a cached or shared answer would say nothing about the endpoint
+    answer = model.with_options(fresh=True).chat("hello")
+    # only a working endpoint is remembered, a failed probe is retried next time
+    if answer is not None:
+        with _lock:
+            _probes[key] = (time.time(), answer)
+    return answer
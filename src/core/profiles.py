@@ -0,0 +1,71 @@
+class GenerationProfile:
+    """Sampling settings of one pipeline stage, sent at the top level of the payload.
+
+    `max_tokens` bounds the worst-case latency of a call; `stop` ends the
+    generation at the closing tag the prompts ask for.
+    """
+
+    def __init__(self, temperature=None, max_tokens=None, stop=None) -> None:
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.stop = list(stop) if stop else None
+
+    @classmethod
+    def from_config(cls, config, base=None):
+        """Build a profile from {"temperature": 1, "max_tokens": 2048, "stop": []}.
+
+        Settings missing from `config` are taken from the `base` profile.
+        """
+        base = base or cls()
+        return cls(
+            temperature=config.get("temperature", base.temperature),
+            max_tokens=config.get("max_tokens", base.max_tokens),
+            stop=config.get("stop", base.stop),
+        )
+
+    def with_max_tokens(self, max_tokens):
+        """A copy of this profile with another `max_tokens`."""
+        return GenerationProfile(self.temperature, max_tokens, self.stop)
+
+    def params(self):
+        params = {}
+        if self.max_tokens is not None:
+            params["max_tokens"] = self.max_tokens
+        if self.stop:
+            params["stop"] = self.stop
+        return params
+
+
+# outline, edit (final outline editing) and write prompts wrap their answer in
+# <format>...</format>; check/refine return a whole subsection; judge answers with a score or yes/no
+PROFILES = {
+    "outline": GenerationProfile(temperature=1, max_tokens=4096, stop=["</format>"]),
+    "edit": GenerationProfile(temperature=1, max_tokens=4096, stop=["</format>"]),
+    "write": GenerationProfile(temperature=1, max_tokens=4096, stop=["</format>"]),
+    "check": GenerationProfile(temperature=1, max_tokens=4096),
+    "refine": GenerationProfile(temperature=1, max_tokens=4096),
+    "judge": GenerationProfile(temperature=0, max_tokens=32),
+}
+
+
+# a word of the requested subsection length can take two tokens, e.g. in Chinese
+TOKENS_PER_WORD = 2
+# room above the expected length for headings, citations and the <format> tags
+SUBSECTION_MARGIN = 1024
+
+
+def subsection_max_tokens(words=None, tokens=None):
+    """A max_tokens that fits a subsection of `words` words, or one rewriting
+    a subsection of `tokens` tokens, without cutting it off."""
+    if tokens is None:
+        tokens = int(words) * TOKENS_PER_WORD
+    return int(tokens * 1.25) + SUBSECTION_MARGIN
+
+
+def load_profiles(config=None):
+    """Default profiles, updated field by field with a config.json "PROFILES"
+    mapping such as {"write": {"max_tokens": 3000}}."""
+    profiles = dict(PROFILES)
+    for stage, entry in (config or {}).items():
+        profiles[stage] = GenerationProfile.from_config(entry, profiles.get(stage))
+    return profiles
@@ -0,0 +1,142 @@
+import threading
+import time
+
+_lock = threading.Lock()
+_limiters = {}
+
+
+class TokenBucket:
+    """Bucket refilled continuously at `per_minute` units per minute."""
+
+    def __init__(self, per_minute, capacity=None) -> None:
+        self.per_minute = per_minute
+        self.capacity = capacity or per_minute
+        self.level = float(self.capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        rate = self.per_minute / 60.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.per_minute / 60.0)
+
+
+class Reservation:
+    def __init__(self, tokens) -> None:
+        self.tokens = tokens
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget of one endpoint.
+
+    Callers reserve their estimated tokens before sending and settle the
+    reservation with the provider-reported usage afterwards, so estimation
+    errors are paid back (or charged) instead of accumulating.
+    """
+
+    def __init__(self, rpm=None, tpm=None) -> None:
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.waited = 0.0
+        self.reserved = 0
+        self.settled = 0
+        self.__lock = threading.Lock()
+
+    def configure(self, rpm=None, tpm=None):
+        """Switch to new budgets, keeping what is left of the current ones."""
+        with self.__lock:
+            now = time.monotonic()
+            self.requests = self.__resize(self.requests, rpm, now)
+            self.tokens = self.__resize(self.tokens, tpm, now)
+
+    @staticmethod
+    def __resize(bucket, per_minute, now):
+        if not per_minute:
+            return None
+        if bucket is None:
+            return TokenBucket(per_minute)
+        if bucket.per_minute != per_minute:
+            bucket.refill(now)
+            level = bucket.level
+            bucket.per_minute = bucket.capacity = per_minute
+            bucket.level = min(level, float(per_minute))
+        return bucket
+
+    def try_reserve(self, tokens):
+        """Return (Reservation, 0) if the budget allows it now, else (None, wait)."""
+        with self.__lock:
+            now = time.monotonic()
+            if self.tokens is not None:
+                # a single prompt larger than the bucket may never fit otherwise
+                tokens = min(tokens, self.tokens.capacity)
+            wait = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amount))
+            if wait > 0:
+                return None, wait
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= tokens
+            self.reserved += tokens
+            return Reservation(tokens), 0.0
+
+    def reserve(self, tokens):
+        while True:
+            reservation, wait = self.try_reserve(tokens)
+            if reservation is not None:
+                return reservation
+            with self.__lock:
+                self.waited += wait
+            time.sleep(wait)
+
+    def settle(self, reservation, actual_tokens):
+        if reservation is None:
+            return
+        with self.__lock:
+            self.settled += actual_tokens
+            if self.tokens is not None:
+                self.tokens.refill(time.monotonic())
+                self.tokens.level = min(
+                    self.tokens.capacity,
+                    self.tokens.level + reservation.tokens - actual_tokens,
+                )
+
+    def stats(self):
+        with self.__lock:
+            now = time.monotonic()
+            for bucket in (self.requests, self.tokens):
+                if bucket is not None:
+                    bucket.refill(now)
+            return {
+                "rpm": self.requests.per_minute if self.requests else None,
+                "tpm": self.tokens.per_minute if self.tokens else None,
+                "requests_available": self.requests.level if self.requests else None,
+                "tokens_available": self.tokens.level if self.tokens else None,
+                "reserved_tokens": self.reserved,
+                "settled_tokens": self.settled,
+                "waited": self.waited,
+            }
+
+
+def get_rate_limiter(api_url, api_key, rpm=None, tpm=None):
+    """Return the budget shared by every APIModel using the same url and key.
+
+    Other `rpm`/`tpm` than the registered ones, e.g. after config.json was
+    edited, replace the budgets of the shared limiter.
+    """
+    with _lock:
+        limiter = _limiters.get((api_url, api_key))
+        if limiter is None:
+            limiter = RateLimiter(rpm=rpm, tpm=tpm)
+            _limiters[(api_url, api_key)] = limiter
+        else:
+            limiter.configure(rpm=rpm, tpm=tpm)
+        return limiter
@@ -0,0 +1,100 @@
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+
+def parse_retry_after(value):
+    """Seconds to wait from a `Retry-After` header (delta-seconds or HTTP-date)."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter, per-attempt timeouts and an overall deadline."""
+
+    RETRY_STATUSES = (408, 409, 425, 429, 500, 502, 503, 504)
+
+    def __init__(
+        self,
+        max_retries=5,
+        base_delay=1.0,
+        max_delay=60.0,
+        multiplier=2.0,
+        jitter=True,
+        connect_timeout=10.0,
+        read_timeout=300.0,
+        deadline=900.0,
+    ) -> None:
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+
+    def should_retry(self, status):
+        # no status means a network error, a 2xx here means an unparsable body
+        return status is None or status < 400 or status in self.RETRY_STATUSES
+
+    def backoff(self, retry, retry_after=None):
+        delay = min(self.base_delay * self.multiplier**retry, self.max_delay)
+        if self.jitter:
+            # "full jitter" spreads retries of concurrent callers apart
+            delay = random.uniform(0, delay)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        return delay
+
+    def timeout(self, remaining=None):
+        read_timeout = self.read_timeout
+        if remaining is not None:
+            read_timeout = max(min(read_timeout, remaining), 0.001)
+        return (self.connect_timeout, read_timeout)
+
+
+class CallLog:
+    """Thread-safe record of the attempts and backoff time spent on each call."""
+
+    def __init__(self, maxlen=1000) -> None:
+        self.records = deque(maxlen=maxlen)
+        self.__lock = threading.Lock()
+
+    def add(self, **record):
+        with self.__lock:
+            self.records.append(record)
+
+    def summary(self):
+        with self.__lock:
+            records = list(self.records)
+        if not records:
+            return {"calls": 0}
+        elapsed = sorted(r["elapsed"] for r in records)
+        summary = {
+            "calls": len(records),
+            "failed": sum(1 for r in records if not r["ok"]),
+            # completions cut off at max_tokens
+            "truncated": sum(1 for r in records if r.get("truncated")),
+            "retries": sum(r["retries"] for r in records),
+            "wait": sum(r["wait"] for r in records),
+            "max_retries": max(r["retries"] for r in records),
+            "p50_elapsed": elapsed[len(elapsed) // 2],
+            "p95_elapsed": elapsed[min(int(len(elapsed) * 0.95), len(elapsed) - 1)],
+            "slowest": sorted(records, key=lambda r: r["elapsed"])[-5:],
+        }
+        ttft = sorted(r["ttft"] for r in records if r.get("ttft") is not None)
+        if ttft:
+            summary["p50_ttft"] = ttft[len(ttft) // 2]
+            summary["p95_ttft"] = ttft[min(int(len(ttft) * 0.95), len(ttft) - 1)]
+        return summary
@@ -0,0 +1,58 @@
+import threading
+from .usage import FIELDS
+
+# pipeline stages a route can be given for; "edit" is the final outline edit
+STAGES = ("outline", "edit", "write", "check", "refine")
+
+
+class ModelRouter:
+    """Send each pipeline stage to its own chat model.
+
+    Stages without a route use `default`, so a router without routes behaves
+    like the single model it wraps. Every routing decision is kept, together
+    with the usage of the routed stage, for the run metrics.
+    """
+
+    def __init__(self, default, routes=None) -> None:
+        self.default = default
+        self.routes = {k: v for k, v in (routes or {}).items() if v is not None}
+        self.__decisions = []
+        self.__lock = threading.Lock()
+
+    def route(self, stage, job=None):
+        """The model view that runs `stage` calls of `job`."""
+        model = self.routes.get(stage, self.default)
+        with self.__lock:
+            self.__decisions.append((stage, job, model, stage in self.routes))
+        return model.with_options(stage=stage, job=job)
+
+    def usage(self, job):
+        """Usage of `job` per model name, summed over the models it was routed to."""
+        usage, seen = {}, set()
+        with self.__lock:
+            models = [m for s, j, m, r in self.__decisions if j == job]
+        for model in models:
+            # views of one model share its counter
+            if id(model.usage) in seen:
+                continue
+            seen.add(id(model.usage))
+            entry = usage.setdefault(model.model, dict.fromkeys(FIELDS, 0))
+            for k, v in model.usage.job(job).items():
+                entry[k] += v
+        return usage
+
+    def stats(self, job=None):
+        """Routing decisions (of `job`, or all) with the usage of each stage."""
+        with self.__lock:
+            decisions = list(self.__decisions)
+        return [
+            {
+                "stage": stage,
+                "job": j,
+                "model": model.model,
+                "routed": routed,
+                "usage": model.usage.job_stage(j, stage),
+            }
+            for stage, j, model, routed in decisions
+            if job is None or j == job
+        ]
@@ -0,0 +1,216 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import OrderedDict, deque
+
+# lower runs first: interactive outlining, then section writing, then evaluation
+PRIORITIES = {
+    "outline": 0,
+    "edit": 0,
+    "write": 1,
+    "check": 1,
+    "refine": 1,
+    "judge": 2,
+}
+DEFAULT_PRIORITY = 1
+
+_lock = threading.Lock()
+_scheduler = None
+_job_ids = itertools.count(1)
+
+
+class _Waiter:
+    __slots__ = ("queued",)
+
+    def __init__(self) -> None:
+        self.queued = time.time()
+
+
+class _Job:
+    def __init__(self, name, priority, weight, vtime) -> None:
+        self.name = name
+        self.priority = priority
+        self.weight = weight
+        # slots granted divided by weight; the smallest waiting job goes next
+        self.vtime = vtime
+        # one FIFO per endpoint pool, so a full pool does not hold up the others
+        self.queues = {}
+        self.running = 0
+        self.granted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def queued(self, pool=None):
+        if pool is None:
+            return sum(len(q) for q in self.queues.values())
+        queue = self.queues.get(pool)
+        return len(queue) if queue else 0
+
+    def stats(self):
+        return {
+            "priority": self.priority,
+            "weight": self.weight,
+            "queued": self.queued(),
+            "running": self.running,
+            "granted": self.granted,
+            "wait_total": self.wait_total,
+            "wait_max": self.wait_max,
+            "wait_mean": self.wait_total / self.granted if self.granted else 0.0,
+        }
+
+
+class Scheduler:
+    """Process-wide admission of LLM requests under one concurrency cap.
+
+    Every request belongs to a job (one agent run) and a stage. The next
+    request to go out is taken from the waiting job with the best stage
+    priority; jobs of equal priority share slots in proportion to their
+    weight. A request is only admitted together with a free endpoint slot,
+    so the order holds even when the provider, not the cap, is the limit.
+    The order is kept per endpoint pool: requests for a busy pool never
+    hold up requests for another one.
+    """
+
+    def __init__(self, max_concurrency=64, max_idle_jobs=100) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_idle_jobs = max_idle_jobs
+        self.in_flight = 0
+        self.jobs = OrderedDict()
+        self.__cond = threading.Condition()
+
+    def __job(self, name, stage, weight):
+        job = self.jobs.get(name)
+        if job is None:
+            # newcomers start level with the active jobs instead of with credit
+            active = [
+                j.vtime for j in self.jobs.values() if j.queued() or j.running
+            ]
+            job = _Job(
+                name,
+                PRIORITIES.get(stage, DEFAULT_PRIORITY),
+                weight,
+                min(active) if active else 0.0,
+            )
+            self.jobs[name] = job
+        return job
+
+    def __enqueue(self, job, stage, weight, pool):
+        with self.__cond:
+            job = self.__job(job, stage, weight)
+            waiter = _Waiter()
+            job.queues.setdefault(pool, deque()).append(waiter)
+            return job, waiter
+
+    def __dequeue(self, job, waiter, pool):
+        queue = job.queues[pool]
+        queue.remove(waiter)
+        if not queue:
+            del job.queues[pool]
+
+    def __try_grant(self, job, waiter, admit, pool):
+        """Admit `waiter` if it is next in line for `pool` and `admit()` gets
+        a slot."""
+        if self.in_flight >= self.max_concurrency:
+            return None
+        if job.queues[pool][0] is not waiter:
+            return None
+        waiting = (j for j in self.jobs.values() if j.queued(pool))
+        if min(waiting, key=lambda j: (j.priority, j.vtime)) is not job:
+            return None
+        slot = admit() if admit is not None else True
+        if slot is None:
+            return None
+        self.__dequeue(job, waiter, pool)
+        wait = time.time() - waiter.queued
+        job.wait_total += wait
+        job.wait_max = max(job.wait_max, wait)
+        job.granted += 1
+        job.running += 1
+        job.vtime += 1.0 / job.weight
+        self.in_flight += 1
+        # the next in line may be admitted too
+        self.__cond.notify_all()
+        return slot
+
+    def acquire(
+        self, job="default", stage=None, weight=1.0, admit=None, pool=None
+    ):
+        """Wait for the turn of `job` and return the slot taken by `admit()`.
+
+        `admit` is a non-blocking callable returning a slot or None, such as
+        EndpointPool.try_pick; `pool` identifies what it draws from, e.g. the
+        EndpointPool itself.
+        """
+        entry, waiter = self.__enqueue(job, stage, weight, pool)
+        with self.__cond:
+            while True:
+                slot = self.__try_grant(entry, waiter, admit, pool)
+                if slot is not None:
+                    return slot
+                # endpoint limits are shared with other pools, so poll as well as wait
+                self.__cond.wait(0.05)
+
+    async def aacquire(
+        self, job="default", stage=None, weight=1.0, admit=None, pool=None
+    ):
+        entry, waiter = self.__enqueue(job, stage, weight, pool)
+        try:
+            while True:
+                with self.__cond:
+                    slot = self.__try_grant(entry, waiter, admit, pool)
+                if slot is not None:
+                    return slot
+                await asyncio.sleep(0.02)
+        except asyncio.CancelledError:
+            with self.__cond:
+                if waiter in entry.queues.get(pool, ()):
+                    self.__dequeue(entry, waiter, pool)
+                    self.__cond.notify_all()
+            raise
+
+    def release(self, job="default"):
+        with self.__cond:
+            entry = self.jobs.get(job)
+            if entry is not None:
+                entry.running -= 1
+            self.in_flight -= 1
+            self.__prune()
+            self.__cond.notify_all()
+
+    def __prune(self):
+        idle = [n for n, j in self.jobs.items() if not j.queues and not j.running]
+        for name in idle[: max(len(idle) - self.max_idle_jobs, 0)]:
+            del self.jobs[name]
+
+    def stats(self):
+        with self.__cond:
+            return {
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self.in_flight,
+                "queued": sum(j.queued() for j in self.jobs.values()),
+                "jobs": {n: j.stats() for n, j in self.jobs.items()},
+            }
+
+
+def new_job_id(prefix):
+    """A process-unique job name such as `outline-3`."""
+    return f"{prefix}-{next(_job_ids)}"
+
+
+def get_scheduler(max_concurrency=None, min_concurrency=None):
+    """Return the scheduler shared by every APIModel in this process.
+
+    A given `max_concurrency` replaces the global cap (64 by default);
+    otherwise `min_concurrency`, e.g. a model's own concurrency, raises the
+    cap so that it does not silently clamp that model.
+    """
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        if max_concurrency:
+            _scheduler.max_concurrency = max_concurrency
+        elif min_concurrency and min_concurrency > _scheduler.max_concurrency:
+            _scheduler.max_concurrency = min_concurrency
+        return _scheduler
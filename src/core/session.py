@@ -0,0 +1,79 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+_lock = threading.Lock()
+_sessions = {}
+
+
+class _PooledSession:
+    def __init__(self, api_url, pool_maxsize):
+        self.api_url = api_url
+        self.pool_maxsize = pool_maxsize
+        self.session = requests.Session()
+        self.adapter = None
+        # counters of adapters replaced by grow()
+        self.retired_requests, self.retired_connections = 0, 0
+        self.__mount(pool_maxsize)
+
+    def __mount(self, pool_maxsize):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        old, self.adapter = self.adapter, adapter
+        self.pool_maxsize = pool_maxsize
+        if old is not None:
+            num_requests, num_connections = self.__count(old)
+            self.retired_requests += num_requests
+            self.retired_connections += num_connections
+            # in-flight connections are closed when they come back to the pool
+            old.close()
+
+    def grow(self, pool_maxsize):
+        # Remounting drops idle connections, so only do it when the pool must grow.
+        if pool_maxsize > self.pool_maxsize:
+            self.__mount(pool_maxsize)
+
+    @staticmethod
+    def __count(adapter):
+        num_requests, num_connections = 0, 0
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            num_requests += pool.num_requests
+            num_connections += pool.num_connections
+        return num_requests, num_connections
+
+    def stats(self):
+        num_requests, num_connections = self.__count(self.adapter)
+        num_requests += self.retired_requests
+        num_connections += self.retired_connections
+        return {
+            "api_url": self.api_url,
+            "pool_maxsize": self.pool_maxsize,
+            "requests": num_requests,
+            "connections": num_connections,
+            "reused": max(num_requests - num_connections, 0),
+        }
+
+
+def get_session(api_url, pool_maxsize=5):
+    """Return the keep-alive session shared by every APIModel using `api_url`."""
+    with _lock:
+        pooled = _sessions.get(api_url)
+        if pooled is None:
+            pooled = _PooledSession(api_url, pool_maxsize)
+            _sessions[api_url] = pooled
+        else:
+            pooled.grow(pool_maxsize)
+        return pooled.session
+
+
+def pool_stats(api_url=None):
+    with _lock:
+        pooled = list(_sessions.values())
+    if api_url is not None:
+        pooled = [p for p in pooled if p.api_url == api_url]
+    return [p.stats() for p in pooled]
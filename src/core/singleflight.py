@@ -0,0 +1,77 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse identical concurrent calls into one; followers share its result."""
+
+    def __init__(self) -> None:
+        self.__lock = threading.Lock()
+        self.__calls = {}
+        self.__futures = {}
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key, fn):
+        """Run `fn()` unless a call with `key` is in flight. Returns (result, shared)."""
+        with self.__lock:
+            call = self.__calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self.__calls[key] = call
+                self.executed += 1
+            else:
+                self.collapsed += 1
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self.__lock:
+                del self.__calls[key]
+            call.event.set()
+        return call.result, False
+
+    async def ado(self, key, coro_fn):
+        """Asyncio counterpart of `do` for calls made on one event loop."""
+        key = (id(asyncio.get_running_loop()), key)
+        with self.__lock:
+            future = self.__futures.get(key)
+            if future is not None:
+                self.collapsed += 1
+            else:
+                self.executed += 1
+        if future is not None:
+            return await asyncio.shield(future), True
+        future = asyncio.ensure_future(coro_fn())
+        with self.__lock:
+            self.__futures[key] = future
+        try:
+            return await asyncio.shield(future), False
+        finally:
+            with self.__lock:
+                self.__futures.pop(key, None)
+
+    def stats(self):
+        with self.__lock:
+            total = self.executed + self.collapsed
+            return {
+                "executed": self.executed,
+                "collapsed": self.collapsed,
+                "in_flight": len(self.__calls) + len(self.__futures),
+                "collapse_rate": self.collapsed / total if total else 0.0,
+            }
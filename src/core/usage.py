@@ -0,0 +1,59 @@
+import threading
+
+FIELDS = ("calls", "prompt_tokens", "completion_tokens", "total_tokens", "estimated")
+
+
+def _empty():
+    return dict.fromkeys(FIELDS, 0)
+
+
+class UsageCounter:
+    """Thread-safe token usage, in total and per stage and per job (run).
+
+    Usage comes from the `usage` block of each response. `estimated` counts
+    the calls whose usage had to be tokenized locally because it was missing.
+    """
+
+    def __init__(self) -> None:
+        self.total = _empty()
+        self.stages = {}
+        self.jobs = {}
+        # (job, stage) -> usage, for per-stage metrics of one run
+        self.job_stages = {}
+        self.__lock = threading.Lock()
+
+    def add(self, stage, job, prompt_tokens, completion_tokens, estimated=False):
+        with self.__lock:
+            for entry in (
+                self.total,
+                self.stages.setdefault(stage or "default", _empty()),
+                self.jobs.setdefault(job or "default", _empty()),
+                self.job_stages.setdefault(
+                    (job or "default", stage or "default"), _empty()
+                ),
+            ):
+                entry["calls"] += 1
+                entry["prompt_tokens"] += prompt_tokens
+                entry["completion_tokens"] += completion_tokens
+                entry["total_tokens"] += prompt_tokens + completion_tokens
+                entry["estimated"] += int(estimated)
+
+    def job(self, job):
+        with self.__lock:
+            return dict(self.jobs.get(job) or _empty())
+
+    def job_stage(self, job, stage):
+        with self.__lock:
+            return dict(self.job_stages.get((job, stage)) or _empty())
+
+    def stage(self, stage):
+        with self.__lock:
+            return dict(self.stages.get(stage) or _empty())
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "total": dict(self.total),
+                "stages": {k: dict(v) for k, v in self.stages.items()},
+                "jobs": {k: dict(v) for k, v in self.jobs.items()},
+            }
@@ -0,0 +1,407 @@
+"""Deterministic stand-in for an OpenAI-compatible /v1/chat/completions endpoint.
+
+Every prompt of src/config/prompt.py and prompt_zh.py is recognised and
+answered with a canned, format-compliant completion, so the agents can run
+end to end without a real provider. Latency follows a configurable
+distribution and errors can be injected. The server only needs the standard
+library.
+
+    python mock_llm_server.py --port 8765 --latency lognormal:-0.7,0.5 --error_rate 0.02
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# (kind, markers) in match order, zh and en markers of each prompt template
+PROMPT_KINDS = [
+    ("nli", ("声明是否忠于来源", "Is the Claim faithful")),
+    ("judge", ("给出1到5的分数", "give a score from 1 to 5")),
+    ("lce", ("需要完善的子部分", "Subsection to Refine")),
+    ("check", ("检查子部分中", "check whether the citations")),
+    ("write", ("现在您需要为子部分", "Return the content of subsection")),
+    ("edit", ("您需要修改大纲", "You need to modify the outline")),
+    ("subsection_outline", ("您需要丰富第", "You need to enrich the section")),
+    ("merge", ("候选大纲列表", "list of outlines as candidates")),
+    ("rough", ("草拟一个大纲", "draft a outline")),
+]
+
+
+def classify(prompt):
+    for kind, markers in PROMPT_KINDS:
+        if any(m in prompt for m in markers):
+            return kind
+    return "other"
+
+
+def approx_tokens(text):
+    # roughly what cl100k gives for mixed Chinese/English text
+    return len(text.encode("utf-8")) // 4 + 1
+
+
+def block_after(prompt, marker):
+    """Text between the `---` lines that follow `marker`."""
+    idx = prompt.find(marker)
+    if idx < 0:
+        return ""
+    rest = prompt[idx:]
+    start = rest.find("---\n")
+    if start < 0:
+        return ""
+    rest = rest[start + 4 :]
+    end = rest.find("\n---")
+    return rest[:end if end >= 0 else len(rest)].strip()
+
+
+class LatencyModel:
+    """`fixed:S`, `uniform:LO,HI` or `lognormal:MU,SIGMA` seconds per request."""
+
+    def __init__(self, spec="fixed:0", per_token=0.0) -> None:
+        name, _, args = spec.partition(":")
+        self.name = name
+        self.args = [float(a) for a in args.split(",") if a]
+        self.per_token = per_token
+
+    def sample(self, rng, completion_tokens):
+        if self.name == "uniform":
+            base = rng.uniform(self.args[0], self.args[1])
+        elif self.name == "lognormal":
+            base = rng.lognormvariate(self.args[0], self.args[1])
+        else:
+            base = self.args[0] if self.args else 0.0
+        return base + self.per_token * completion_tokens
+
+
+class MockLLM:
+    """Canned completions for each prompt kind of the survey pipeline."""
+
+    def __init__(self, subsections=3, yes_rate=1.0) -> None:
+        self.subsections = subsections
+        self.yes_rate = yes_rate
+
+    def complete(self, prompt, rng):
+        kind = classify(prompt)
+        zh = re.search(r"[一-鿿]", prompt[:200]) is not None
+        return kind, getattr(self, f"_{kind}")(prompt, rng, zh)
+
+    def _topic(self, prompt):
+        m = re.search(r"关于 \"?(.+?)\"? 的", prompt) or re.search(
+            r"survey about \"?(.+?)\"?[.\n]", prompt
+        )
+        return m.group(1).strip() if m else "the topic"
+
+    def _sections(self, title, names, descriptions):
+        lines = [f"Title: {title}"]
+        for i, (n, d) in enumerate(zip(names, descriptions)):
+            lines += [f"Section {i+1}: {n}", f"Description {i+1}: {d}", ""]
+        return "<format>\n" + "\n".join(lines) + "</format>"
+
+    def _rough(self, prompt, rng, zh):
+        m = re.search(r"包含 (\d+) 个部分", prompt) or re.search(
+            r"contains (\d+) sections", prompt
+        )
+        num = int(m.group(1)) if m else 4
+        topic = self._topic(prompt)
+        names = [f"{topic} aspect {i+1}" for i in range(num)]
+        descriptions = [f"Reviews aspect {i+1} of {topic}." for i in range(num)]
+        return self._sections(f"A Survey of {topic}", names, descriptions)
+
+    def _merge(self, prompt, rng, zh):
+        nums = [int(n) for n in re.findall(r"Section (\d+):", prompt)]
+        num = max(nums) if nums else 4
+        topic = self._topic(prompt)
+        names = [f"{topic} aspect {i+1}" for i in range(num)]
+        descriptions = [f"Reviews aspect {i+1} of {topic}." for i in range(num)]
+        return self._sections(f"A Survey of {topic}", names, descriptions)
+
+    def _subsection_outline(self, prompt, rng, zh):
+        m = re.search(r"您需要丰富第 (.+?) 部分", prompt) or re.search(
+            r"enrich the section (.+?)\.?\n", prompt
+        )
+        section = m.group(1).strip() if m else "section"
+        lines = []
+        for i in range(self.subsections):
+            lines += [
+                f"Subsection {i+1}: {section} topic {i+1}",
+                f"Description {i+1}: Discusses topic {i+1} of {section}.",
+                "",
+            ]
+        return "<format>\n" + "\n".join(lines) + "</format>"
+
+    def _edit(self, prompt, rng, zh):
+        marker = "草稿大纲" if zh else "draft outline"
+        return "<format>\n" + block_after(prompt, marker) + "\n</format>"
+
+    def _write(self, prompt, rng, zh):
+        titles = re.findall(r"paper_title: (.+)", prompt)
+        m = re.search(r"超过 (\d+) 个单词", prompt) or re.search(
+            r"more than (\d+) words", prompt
+        )
+        words = int(m.group(1)) if m else 300
+        sentences = []
+        for i in range(max(words // 12, 1)):
+            sentence = f"Finding {i+1} summarises prior work on this subsection"
+            if titles:
+                cited = rng.sample(titles, min(2, len(titles)))
+                sentence += " [" + "; ".join(t.strip() for t in cited) + "]"
+            sentences.append(sentence + ".")
+        return "<format>\n" + " ".join(sentences) + "\n</format>"
+
+    def _check(self, prompt, rng, zh):
+        marker = "您已经撰写了以下子部分" if zh else "You have written a subsection below"
+        return block_after(prompt, marker)
+
+    def _lce(self, prompt, rng, zh):
+        return block_after(prompt, "需要完善的子部分" if zh else "Subsection to Refine")
+
+    def _nli(self, prompt, rng, zh):
+        yes = rng.random() < self.yes_rate
+        if zh:
+            return "是" if yes else "否"
+        return "Yes" if yes else "No"
+
+    def _judge(self, prompt, rng, zh):
+        return str(rng.randint(3, 5))
+
+    def _other(self, prompt, rng, zh):
+        return "Hello! This is the mock LLM server."
+
+
+class MockLLMServer:
+    """Threaded HTTP server answering chat completions with `MockLLM`."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        latency="fixed:0",
+        per_token=0.0,
+        error_rate=0.0,
+        error_statuses=(429, 500, 503),
+        retry_after=1,
+        slow_rate=0.0,
+        slow_factor=10.0,
+        seed=0,
+        llm=None,
+    ) -> None:
+        self.latency = LatencyModel(latency, per_token)
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+        self.seed = seed
+        self.llm = llm or MockLLM()
+        self.__lock = threading.Lock()
+        self.__seen = {}
+        self.reset_stats()
+        self.httpd = ThreadingHTTPServer((host, port), self.__handler())
+        self.httpd.daemon_threads = True
+        self.__thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self.__thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def reset_stats(self):
+        with self.__lock:
+            self.__stats = {}
+
+    def stats(self):
+        with self.__lock:
+            return json.loads(json.dumps(self.__stats))
+
+    def __count(self, kind, **values):
+        with self.__lock:
+            entry = self.__stats.setdefault(
+                kind,
+                {
+                    "requests": 0,
+                    "errors": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latency": 0.0,
+                },
+            )
+            entry["requests"] += 1
+            for k, v in values.items():
+                entry[k] += v
+
+    def __rng(self, prompt):
+        # deterministic per prompt and per repetition, so retries may differ
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        with self.__lock:
+            n = self.__seen.get(digest, 0)
+            self.__seen[digest] = n + 1
+        return random.Random(f"{self.seed}:{digest}:{n}")
+
+    def respond(self, payload):
+        """Return (status, headers, body or list of SSE chunks, delay)."""
+        prompt = "".join(m.get("content", "") for m in payload.get("messages", []))
+        rng = self.__rng(prompt)
+        kind = classify(prompt)
+        prompt_tokens = approx_tokens(prompt)
+        if rng.random() < self.error_rate:
+            status = rng.choice(self.error_statuses)
+            self.__count(kind, errors=1)
+            headers = {"Retry-After": str(self.retry_after)} if status == 429 else {}
+            body = {"error": {"message": "injected error", "code": status}}
+            return status, headers, body, self.latency.sample(rng, 0) * 0.1
+        kind, content = self.llm.complete(prompt, rng)
+        completion_tokens = approx_tokens(content)
+        delay = self.latency.sample(rng, completion_tokens)
+        if rng.random() < self.slow_rate:
+            delay *= self.slow_factor
+        self.__count(
+            kind,
+            prompt_tokens=prompt_tokens,
+            completion_tokens=completion_tokens,
+            latency=delay,
+        )
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        model = payload.get("model", "mock")
+        if payload.get("stream"):
+            chunks = [content[i : i + 16] for i in range(0, len(content), 16)]
+            events = [
+                {"model": model, "choices": [{"index": 0, "delta": {"content": c}}]}
+                for c in chunks
+            ]
+            events.append(
+                {
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                    "usage": usage,
+                }
+            )
+            return 200, {}, events, delay
+        body = {
+            "id": f"mock-{rng.getrandbits(32):08x}",
+            "object": "chat.completion",
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+        return 200, {}, body, delay
+
+    def __handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/stats"):
+                    self.__send(200, {}, server.stats())
+                else:
+                    self.__send(404, {}, {"error": "not found"})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if not self.path.rstrip("/").endswith("chat/completions"):
+                    self.__send(404, {}, {"error": "not found"})
+                    return
+                status, headers, body, delay = server.respond(payload)
+                if isinstance(body, list):
+                    self.__stream(body, delay)
+                else:
+                    time.sleep(delay)
+                    self.__send(status, headers, body)
+
+            def __send(self, status, headers, body):
+                data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def __stream(self, events, delay):
+                # a fifth of the latency before the first token, the rest spread out
+                time.sleep(delay * 0.2)
+                step = delay * 0.8 / max(len(events), 1)
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                for event in events:
+                    data = json.dumps(event, ensure_ascii=False)
+                    self.wfile.write(f"data: {data}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                    time.sleep(step)
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+        return Handler
+
+
+def paras_args():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument(
+        "--latency",
+        default="fixed:0.2",
+        type=str,
+        help="fixed:S, uniform:LO,HI or lognormal:MU,SIGMA seconds per request",
+    )
+    parser.add_argument(
+        "--per_token", default=0.0, type=float, help="extra seconds per output token"
+    )
+    parser.add_argument("--error_rate", default=0.0, type=float)
+    parser.add_argument("--error_statuses", default="429,500,503", type=str)
+    parser.add_argument("--slow_rate", default=0.0, type=float)
+    parser.add_argument("--slow_factor", default=10.0, type=float)
+    parser.add_argument("--seed", default=0, type=int)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = paras_args()
+    server = MockLLMServer(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        per_token=args.per_token,
+        error_rate=args.error_rate,
+        error_statuses=[int(s) for s in args.error_statuses.split(",")],
+        slow_rate=args.slow_rate,
+        slow_factor=args.slow_factor,
+        seed=args.seed,
+    )
+    print(f"mock LLM server listening on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
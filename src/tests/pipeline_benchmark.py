@@ -0,0 +1,217 @@
+"""End-to-end benchmark of outlineWriter.draft_outline and subsectionWriter.write
+against the mock LLM server, with an in-memory paper database.
+
+Run it from a ComfyUI checkout with this package under custom_nodes:
+
+    python custom_nodes/ComfyUI_Autosurvey/src/tests/pipeline_benchmark.py \
+        --papers 300 --reference_num 200 --section_num 4 --latency lognormal:-1,0.5
+
+Wall time, LLM calls and prompt/completion tokens are reported per stage and
+per prompt kind. No GPU, vector database or provider key is needed.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+# this file lives in <ComfyUI>/custom_nodes/ComfyUI_Autosurvey/src/tests
+_ROOT = Path(__file__).resolve().parents[4]
+
+WORDS = (
+    "retrieval augmented generation language models survey benchmark evaluation "
+    "alignment reasoning agents planning memory tools multimodal efficiency "
+    "compression distillation attention transformer decoding context scaling"
+).split()
+
+
+class MockDatabase:
+    """Deterministic in-memory implementation of the Database interface."""
+
+    def __init__(self, papers=300, content_words=400, latency=0.0, seed=0) -> None:
+        rng = random.Random(seed)
+        self.latency = latency
+        self.papers = {}
+        for i in range(papers):
+            topic = " ".join(rng.sample(WORDS, 3))
+            self.papers[f"paper-{i}"] = {
+                "id": f"paper-{i}",
+                "title": f"Paper {i} on {topic}",
+                "content": " ".join(rng.choice(WORDS) for _ in range(content_words)),
+            }
+        self.ids = list(self.papers)
+        self.by_title = {p["title"]: i for i, p in self.papers.items()}
+
+    def get_ids_from_query(self, query, num, shuffle=False):
+        time.sleep(self.latency)
+        seed = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        ids = random.Random(seed).sample(self.ids, min(num, len(self.ids)))
+        if shuffle:
+            random.shuffle(ids)
+        return ids
+
+    def get_paper_info_from_ids(self, ids):
+        time.sleep(self.latency)
+        return [self.papers[i] for i in ids]
+
+    def get_titles_from_citations(self, citations):
+        # unknown titles map to some paper, like a nearest-neighbour lookup would
+        return [
+            self.by_title.get(c)
+            or self.ids[int(hashlib.sha256(c.encode("utf-8")).hexdigest(), 16) % len(self.ids)]
+            for c in citations
+        ]
+
+
+def diff_stats(after, before):
+    """Per-kind server counters accumulated between two snapshots."""
+    res = {}
+    for kind, values in after.items():
+        prev = before.get(kind, {})
+        res[kind] = {k: v - prev.get(k, 0) for k, v in values.items()}
+    return res
+
+
+def summarize(kinds):
+    total = {"requests": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    for values in kinds.values():
+        for k in total:
+            total[k] += values[k]
+    return total
+
+
+def run_stage(name, fn, server, model):
+    before = server.stats()
+    start = time.time()
+    result = fn()
+    wall = time.time() - start
+    kinds = diff_stats(server.stats(), before)
+    report = {
+        "stage": name,
+        "wall_time": wall,
+        **summarize(kinds),
+        "kinds": kinds,
+        "client": model.retry_stats(),
+    }
+    return result, report
+
+
+def print_report(reports):
+    print(
+        f"{'stage':<10}{'wall(s)':>10}{'calls':>8}{'errors':>8}"
+        f"{'prompt_tok':>12}{'compl_tok':>12}"
+    )
+    for r in reports:
+        print(
+            f"{r['stage']:<10}{r['wall_time']:>10.2f}{r['requests']:>8}{r['errors']:>8}"
+            f"{r['prompt_tokens']:>12}{r['completion_tokens']:>12}"
+        )
+        for kind, v in sorted(r["kinds"].items()):
+            print(
+                f"  {kind:<18}{v['requests']:>8}{v['errors']:>8}"
+                f"{v['prompt_tokens']:>12}{v['completion_tokens']:>12}"
+            )
+
+
+def paras_args():
+    parser = argparse.ArgumentParser(description="AutoSurvey pipeline benchmark")
+    parser.add_argument("--comfyui_root", default=str(_ROOT), type=str)
+    parser.add_argument("--topic", default="大语言模型中的检索增强生成", type=str)
+    parser.add_argument("--papers", default=300, type=int)
+    parser.add_argument("--content_words", default=400, type=int)
+    parser.add_argument("--db_latency", default=0.0, type=float)
+    parser.add_argument("--reference_num", default=200, type=int)
+    parser.add_argument("--section_num", default=4, type=int)
+    parser.add_argument("--chunk_size", default=30000, type=int)
+    parser.add_argument("--rag_num", default=10, type=int)
+    parser.add_argument("--subsection_len", default=300, type=int)
+    parser.add_argument("--no_refining", action="store_true")
+    parser.add_argument("--latency", default="lognormal:-1.5,0.5", type=str)
+    parser.add_argument("--per_token", default=0.0, type=float)
+    parser.add_argument("--error_rate", default=0.0, type=float)
+    parser.add_argument("--slow_rate", default=0.0, type=float)
+    parser.add_argument("--max_concurrency", default=32, type=int)
+    parser.add_argument("--use_async", action="store_true")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--json", default="", type=str, help="write the report here")
+    return parser.parse_args()
+
+
+def main():
+    args = paras_args()
+    # the agents import ComfyUI_Autosurvey.*, custom_nodes.* and folder_paths
+    sys.path[:0] = [args.comfyui_root, os.path.join(args.comfyui_root, "custom_nodes")]
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+    from mock_llm_server import MockLLMServer
+    from ComfyUI_Autosurvey.src.core.model import APIModel
+    from ComfyUI_Autosurvey.src.core.retry import RetryPolicy
+    from ComfyUI_Autosurvey.src.agents.outline_writer import outlineWriter
+    from ComfyUI_Autosurvey.src.agents.writer import subsectionWriter
+
+    server = MockLLMServer(
+        latency=args.latency,
+        per_token=args.per_token,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        seed=args.seed,
+    ).start()
+    db = MockDatabase(
+        papers=args.papers,
+        content_words=args.content_words,
+        latency=args.db_latency,
+        seed=args.seed,
+    )
+
+    def new_model():
+        return APIModel(
+            "mock",
+            "mock-key",
+            server.url,
+            max_concurrency=args.max_concurrency,
+            use_async=args.use_async,
+            retry_policy=RetryPolicy(base_delay=0.1, max_delay=2.0),
+        )
+
+    reports = []
+    try:
+        model = new_model()
+        outline, report = run_stage(
+            "outline",
+            lambda: outlineWriter(model, db).draft_outline(
+                args.topic,
+                reference_num=args.reference_num,
+                section_num=args.section_num,
+                chunk_size=args.chunk_size,
+            ),
+            server,
+            model,
+        )
+        reports.append(report)
+        model = new_model()
+        _, report = run_stage(
+            "write",
+            lambda: subsectionWriter(model, db).write(
+                args.topic,
+                outline,
+                rag_num=args.rag_num,
+                subsection_len=args.subsection_len,
+                refining=not args.no_refining,
+            ),
+            server,
+            model,
+        )
+        reports.append(report)
+    finally:
+        server.stop()
+    print_report(reports)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
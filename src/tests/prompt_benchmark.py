@@ -0,0 +1,144 @@
+"""Micro-benchmark of prompt rendering: the per-placeholder str.replace loop the
+agents used against the compiled single-pass templates of config/template.py.
+
+    python src/tests/prompt_benchmark.py --papers 50 --content_words 400
+
+Each prompt of config/prompt_zh.py is rendered with the parameters its agent
+passes; [PAPER LIST] gets `--papers` synthetic papers. Only the standard
+library and the prompt modules are needed.
+"""
+
+import argparse
+import json
+import random
+import sys
+import timeit
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "config"))
+import prompt_zh  # noqa: E402
+from template import compile_prompt, render  # noqa: E402
+
+WORDS = (
+    "retrieval augmented generation language models survey benchmark evaluation "
+    "alignment reasoning agents planning memory tools multimodal efficiency "
+    "检索 增强 生成 大语言模型 综述 评估 推理 智能体 记忆 工具"
+).split()
+
+
+def legacy_render(template, paras):
+    prompt = template
+    for k in paras.keys():
+        prompt = prompt.replace(f"[{k}]", paras[k])
+    return prompt
+
+
+def paper_list(rng, papers, content_words):
+    text = ""
+    for i in range(papers):
+        content = " ".join(rng.choice(WORDS) for _ in range(content_words))
+        text += f"---\n\npaper_title: Paper {i}\n\npaper_content:\n\n{content}\n"
+    return text + "---\n"
+
+
+def cases(rng, args):
+    papers = paper_list(rng, args.papers, args.content_words)
+    outline = "\n".join(
+        f"## {i} Section {i}\nDescription: {' '.join(rng.sample(WORDS, 12))}"
+        for i in range(1, 9)
+    )
+    subsection = " ".join(rng.choice(WORDS) for _ in range(args.subsection_words))
+    topic = "大语言模型中的检索增强生成"
+    return {
+        "ROUGH_OUTLINE_PROMPT": {
+            "PAPER LIST": papers,
+            "TOPIC": topic,
+            "SECTION NUM": "6",
+        },
+        "SUBSECTION_OUTLINE_PROMPT": {
+            "OVERALL OUTLINE": outline,
+            "SECTION NAME": "Section 1",
+            "SECTION DESCRIPTION": "description",
+            "TOPIC": topic,
+            "PAPER LIST": papers,
+        },
+        "SUBSECTION_WRITING_PROMPT": {
+            "OVERALL OUTLINE": outline,
+            "SUBSECTION NAME": "Subsection 1.1",
+            "DESCRIPTION": "description",
+            "TOPIC": topic,
+            "PAPER LIST": papers,
+            "SECTION NAME": "Section 1",
+            "WORD NUM": "700",
+        },
+        "CHECK_CITATION_PROMPT": {
+            "SUBSECTION": subsection,
+            "TOPIC": topic,
+            "PAPER LIST": papers,
+        },
+        "LCE_PROMPT": {
+            "PREVIOUS": subsection,
+            "FOLLOWING": subsection,
+            "TOPIC": topic,
+            "SUBSECTION": subsection,
+        },
+    }
+
+
+def paras_args():
+    parser = argparse.ArgumentParser(description="Prompt rendering micro-benchmark")
+    parser.add_argument("--papers", default=50, type=int)
+    parser.add_argument("--content_words", default=400, type=int)
+    parser.add_argument("--subsection_words", default=700, type=int)
+    parser.add_argument("--repeat", default=5, type=int)
+    parser.add_argument("--number", default=200, type=int)
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("--json", default="", type=str, help="write the report here")
+    return parser.parse_args()
+
+
+def main():
+    args = paras_args()
+    rng = random.Random(args.seed)
+    report = []
+    for name, paras in cases(rng, args).items():
+        template = getattr(prompt_zh, name)
+        compile_time = timeit.timeit(
+            lambda: compile_prompt(template + " ", paras.keys()), number=1
+        )
+        times = {}
+        for label, fn in (("replace", legacy_render), ("compiled", render)):
+            runs = timeit.repeat(
+                lambda: fn(template, paras), repeat=args.repeat, number=args.number
+            )
+            times[label] = min(runs) / args.number
+        report.append(
+            {
+                "prompt": name,
+                "chars": len(render(template, paras)),
+                "compile_ms": compile_time * 1e3,
+                "replace_us": times["replace"] * 1e6,
+                "compiled_us": times["compiled"] * 1e6,
+                "speedup": times["replace"] / times["compiled"],
+                # the replace loop also substitutes placeholders found in values
+                "same_output": legacy_render(template, paras)
+                == render(template, paras),
+            }
+        )
+    print(
+        f"{'prompt':<28}{'chars':>10}{'compile ms':>12}"
+        f"{'replace us':>12}{'compiled us':>13}{'speedup':>9}  same"
+    )
+    for r in report:
+        print(
+            f"{r['prompt']:<28}{r['chars']:>10}{r['compile_ms']:>12.3f}"
+            f"{r['replace_us']:>12.1f}{r['compiled_us']:>13.1f}"
+            f"{r['speedup']:>8.2f}x  {r['same_output']}"
+        )
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=4)
+
+
+if __name__ == "__main__":
+    main()
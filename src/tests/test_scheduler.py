@@ -0,0 +1,95 @@
+"""Regression tests of core/scheduler.py; stdlib only.
+
+    cd src/tests && python -m pytest test_scheduler.py
+
+Run from this directory: from the repo root pytest imports the package
+__init__.py and with it every node's dependencies.
+"""
+
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from core.scheduler import Scheduler  # noqa: E402
+
+
+class Pool:
+    """Stand-in for EndpointPool.try_pick with a fixed number of slots."""
+
+    def __init__(self, slots) -> None:
+        self.slots = slots
+        self.lock = threading.Lock()
+
+    def try_pick(self):
+        with self.lock:
+            if self.slots <= 0:
+                return None
+            self.slots -= 1
+            return self
+
+    def put(self):
+        with self.lock:
+            self.slots += 1
+
+
+def acquire_in_thread(scheduler, job, stage, pool):
+    done = threading.Event()
+
+    def run():
+        scheduler.acquire(job, stage, admit=pool.try_pick, pool=pool)
+        done.set()
+
+    threading.Thread(target=run, daemon=True).start()
+    return done
+
+
+def test_full_pool_does_not_block_other_pool_of_better_job():
+    scheduler = Scheduler(max_concurrency=16)
+    slow, fast = Pool(0), Pool(4)
+    # the outline job ranks first but waits on a full endpoint pool
+    blocked = acquire_in_thread(scheduler, "outline-1", "outline", slow)
+    time.sleep(0.1)
+    judged = acquire_in_thread(scheduler, "judge-1", "judge", fast)
+    assert judged.wait(0.5)
+    assert not blocked.is_set()
+    slow.put()
+    assert blocked.wait(0.5)
+
+
+def test_full_pool_does_not_block_same_job_on_other_pool():
+    scheduler = Scheduler(max_concurrency=16)
+    strong, quick = Pool(0), Pool(4)
+    # a writer's drafts wait on the strong model, its checks use a fast one
+    drafting = acquire_in_thread(scheduler, "write-1", "write", strong)
+    time.sleep(0.1)
+    checking = acquire_in_thread(scheduler, "write-1", "check", quick)
+    assert checking.wait(0.5)
+    assert not drafting.is_set()
+    strong.put()
+    assert drafting.wait(0.5)
+
+
+def test_priority_still_orders_requests_for_one_pool():
+    scheduler = Scheduler(max_concurrency=16)
+    pool = Pool(0)
+    judged = acquire_in_thread(scheduler, "judge-2", "judge", pool)
+    time.sleep(0.1)
+    outlined = acquire_in_thread(scheduler, "outline-2", "outline", pool)
+    time.sleep(0.1)
+    pool.put()
+    assert outlined.wait(0.5)
+    assert not judged.is_set()
+    pool.put()
+    assert judged.wait(0.5)
+
+
+def test_global_cap_applies_across_pools():
+    scheduler = Scheduler(max_concurrency=1)
+    first, second = Pool(1), Pool(1)
+    assert acquire_in_thread(scheduler, "a", "write", first).wait(0.5)
+    other = acquire_in_thread(scheduler, "b", "write", second)
+    assert not other.wait(0.2)
+    scheduler.release("a")
+    assert other.wait(0.5)
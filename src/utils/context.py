@@ -0,0 +1,146 @@
+import bisect
+import itertools
+import math
+from .utils import tokenCounter
+
+# token budget of the [PAPER LIST] of each stage's prompt
+PAPER_LIST_BUDGETS = {"outline": 32000, "write": 16000}
+
+PAPER_ENTRY = "---\npaper_title: {title}\n\npaper_content:\n\n{content}\n"
+PAPER_LIST_END = "---\n"
+
+
+class PackedContext:
+    """A [PAPER LIST] text and what was left out of it to fit the budget."""
+
+    def __init__(self, text, kept, dropped, truncated, tokens, budget) -> None:
+        self.text = text
+        # indices into the ranked references
+        self.kept = kept
+        self.dropped = dropped
+        # index of a reference cut with text_truncation, or None
+        self.truncated = truncated
+        self.tokens = tokens
+        self.budget = budget
+
+    def stats(self):
+        return {
+            "kept": len(self.kept),
+            "dropped": list(self.dropped),
+            "truncated": self.truncated,
+            "tokens": self.tokens,
+            "budget": self.budget,
+        }
+
+
+def pack_papers(titles, contents, budget, token_counter=None, entry=PAPER_ENTRY):
+    """Fill `budget` tokens with whole references, best ranked first.
+
+    A reference that does not fit is skipped and the next ones are tried,
+    so smaller chunks still use the space left. Only when not even one
+    reference fits is the top one cut down with `text_truncation`.
+    """
+    token_counter = token_counter or tokenCounter()
+    entries = [entry.format(title=t, content=c) for t, c in zip(titles, contents)]
+    counts = token_counter.num_tokens_from_strings(entries + [PAPER_LIST_END])
+    left = budget - counts[-1]
+    kept, dropped = [], []
+    for i, count in enumerate(counts[:-1]):
+        if count <= left:
+            kept.append(i)
+            left -= count
+        else:
+            dropped.append(i)
+    texts = [entries[i] for i in kept]
+    truncated = None
+    if not kept and entries and left > 1:
+        truncated = 0
+        dropped.remove(0)
+        # keep a token for the newline that ends the entry
+        text = token_counter.text_truncation(entries[0], max_len=left - 1)
+        texts = [text + "\n"]
+        left -= token_counter.num_tokens_from_string(texts[0])
+    return PackedContext(
+        "".join(texts) + PAPER_LIST_END,
+        kept,
+        dropped,
+        truncated,
+        budget - left,
+        budget,
+    )
+
+
+def _min_max_cuts(counts, parts):
+    """Cuts of the contiguous split into at most `parts` chunks whose largest
+    chunk is as small as possible (binary search on that size)."""
+
+    def greedy(limit):
+        cuts, load = [], 0
+        for i, count in enumerate(counts):
+            if load + count > limit and load > 0:
+                cuts.append(i)
+                load = 0
+            load += count
+        return cuts
+
+    lo, hi = max(counts), sum(counts)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if len(greedy(mid)) + 1 <= parts:
+            hi = mid
+        else:
+            lo = mid + 1
+    return greedy(lo)
+
+
+def _even_cuts(prefix, parts):
+    """Cut where the running total is closest to k * total / parts."""
+    n, total = len(prefix) - 1, prefix[-1]
+    cuts, last = [], 0
+    for k in range(1, parts):
+        target = total * k / parts
+        i = bisect.bisect_left(prefix, target)
+        if i > last + 1 and target - prefix[i - 1] < prefix[min(i, n)] - target:
+            i -= 1
+        # every chunk keeps at least one paper
+        i = min(max(i, last + 1), n - (parts - k))
+        cuts.append(i)
+        last = i
+    return cuts
+
+
+def chunk_loads(counts, cuts):
+    """Token total of each chunk between the cuts."""
+    bounds = [0] + list(cuts) + [len(counts)]
+    return [sum(counts[a:b]) for a, b in zip(bounds, bounds[1:])]
+
+
+def balanced_cuts(counts, cap, tolerance=0.1):
+    """Split points of a contiguous partition of `counts` into token-balanced
+    chunks of at most `cap` tokens.
+
+    Starts from ceil(total / cap) chunks, adding one while a chunk is over
+    the cap, and cuts where the running total is closest to the even share;
+    if the largest chunk is then more than `tolerance` above the mean, the
+    min-max partition is used instead. A single count above `cap` gets a
+    chunk of its own.
+    """
+    if not counts:
+        return []
+    prefix = list(itertools.accumulate(counts, initial=0))
+    total, n = prefix[-1], len(counts)
+    parts = min(max(math.ceil(total / cap), 1), n)
+    while True:
+        cuts = _even_cuts(prefix, parts)
+        loads = chunk_loads(counts, cuts)
+        if max(loads) > (1 + tolerance) * total / parts:
+            exact = _min_max_cuts(counts, parts)
+            if max(chunk_loads(counts, exact)) < max(loads):
+                cuts, loads = exact, chunk_loads(counts, exact)
+        bounds = [0] + cuts + [n]
+        if parts == n or all(
+            load <= cap or b - a == 1
+            for load, a, b in zip(loads, bounds, bounds[1:])
+        ):
+            return cuts
+        parts += 1
@@ -3,6 +3,8 @@ import json
 import argparse
 from ComfyUI_Autosurvey.src.database.wv_database import database
 from src.agents.judge import Judge
+from src.core.model import APIModel
+from src.core.batch import BatchRunner, LocalBatchBackend, OpenAIBatchBackend
 
 def paras_args():
     parser = argparse.ArgumentParser(description='')
@@ -14,6 +16,9 @@ def paras_args():
     parser.add_argument('--api_key',default='', type=str, help='API key for the model')
     parser.add_argument('--db_path',default='./database', type=str, help='Directory of the database.')
     parser.add_argument('--embedding_model',default='nomic-ai/nomic-embed-text-v1', type=str, help='Embedding model for retrieval.')
+    parser.add_argument('--batch_mode',default='none', choices=['none', 'api', 'local'], help='Send NLI checks through the Batch API (api) or its file-based stand-in (local)')
+    parser.add_argument('--batch_dir',default='./batches', type=str, help='Directory for batch JSONL files')
+    parser.add_argument('--poll_interval',default=30.0, type=float, help='Seconds between batch status polls')
     args = parser.parse_args()
 
     return args
@@ -30,7 +35,16 @@ def evaluate(args):
     if not os.path.exists(args.saving_path):
         os.mkdir(args.saving_path)
 
-    judge = Judge(args.model, args.api_key, args.api_url, db)
+    batch = None
+    if args.batch_mode == 'api':
+        backend = OpenAIBatchBackend(args.api_url, args.api_key)
+        batch = BatchRunner(backend, args.batch_dir, poll_interval=args.poll_interval)
+    elif args.batch_mode == 'local':
+        model = APIModel(args.model, args.api_key, args.api_url)
+        backend = LocalBatchBackend(args.batch_dir, respond=model.chat)
+        batch = BatchRunner(backend, args.batch_dir, poll_interval=1.0)
+
+    judge = Judge(args.model, args.api_key, args.api_url, db, batch=batch)
 
     survey, references = read_survey(args.saving_path, args.topic)
 
@@ -1,23 +1,172 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
 from typing import List
 import tiktoken
+import tiktoken.load
+
+ENCODING_NAME = "cl100k_base"  # the encoding of gpt-3.5-turbo / gpt-4
+# the cl100k_base split pattern and special tokens, as tiktoken_ext defines them
+CL100K_PAT_STR = (
+    r"""(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}|"""
+    r""" ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"""
+)
+CL100K_SPECIAL_TOKENS = {
+    "<|endoftext|>": 100257,
+    "<|fim_prefix|>": 100258,
+    "<|fim_middle|>": 100259,
+    "<|fim_suffix|>": 100260,
+    "<|endofprompt|>": 100276,
+}
+_ROOT = os.path.normpath(
+    os.path.join(os.path.dirname(os.path.realpath(__file__)), "../..")
+)
+# where a BPE file copied from a machine with network is looked for, unless
+# config.json names another one with "TOKENIZER_BPE"
+BUNDLED_BPE = os.path.join(_ROOT, "tokenizer", f"{ENCODING_NAME}.tiktoken")
+CONFIG_PATH = os.path.join(_ROOT, "config.json")
+
+_lock = threading.Lock()
+_encoding = None
+
+
+def bpe_path():
+    """The local BPE file: config.json "TOKENIZER_BPE" (relative to the node's
+    directory) or else BUNDLED_BPE."""
+    path = BUNDLED_BPE
+    if os.path.exists(CONFIG_PATH):
+        with open(CONFIG_PATH, "r") as f:
+            path = json.load(f).get("TOKENIZER_BPE") or path
+    return os.path.join(_ROOT, path)
+
+
+def get_encoding():
+    """The process-wide encoder, loaded on first use.
+
+    A local BPE file is loaded directly so no download happens; without one
+    tiktoken resolves the encoding with its own cache and environment, which
+    needs network access the first time.
+    """
+    global _encoding
+    if _encoding is not None:
+        return _encoding
+    with _lock:
+        if _encoding is None:
+            path = bpe_path()
+            if os.path.exists(path):
+                _encoding = tiktoken.Encoding(
+                    name=ENCODING_NAME,
+                    pat_str=CL100K_PAT_STR,
+                    mergeable_ranks=tiktoken.load.load_tiktoken_bpe(path),
+                    special_tokens=CL100K_SPECIAL_TOKENS,
+                )
+            else:
+                logging.warning(
+                    f"No {ENCODING_NAME} BPE file at {path}, tiktoken will "
+                    "download it; copy it there or set TOKENIZER_BPE in "
+                    "config.json to work offline"
+                )
+                _encoding = tiktoken.get_encoding(ENCODING_NAME)
+    return _encoding
+
+
+class _CountCache:
+    """LRU of token counts keyed by a digest of the text, not the text itself."""
+
+    def __init__(self, maxsize=100000) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.__counts = OrderedDict()
+        self.__lock = threading.Lock()
+
+    @staticmethod
+    def key(text):
+        return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+    def get(self, key):
+        with self.__lock:
+            count = self.__counts.get(key)
+            if count is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__counts.move_to_end(key)
+            return count
+
+    def put(self, key, count):
+        with self.__lock:
+            self.__counts[key] = count
+            self.__counts.move_to_end(key)
+            while len(self.__counts) > self.maxsize:
+                self.__counts.popitem(last=False)
+
+    def stats(self):
+        with self.__lock:
+            return {
+                "size": len(self.__counts),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+_counts = _CountCache()
 
 
 class tokenCounter:
 
     def __init__(self) -> None:
-        self.encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+        # prices are per instance, the encoder and counts are shared process-wide
         self.model_price = {}
 
+    @property
+    def encoding(self):
+        return get_encoding()
+
     def num_tokens_from_string(self, string: str) -> int:
-        return len(self.encoding.encode(string))
+        key = _counts.key(string)
+        count = _counts.get(key)
+        if count is None:
+            count = len(self.encoding.encode_ordinary(string))
+            _counts.put(key, count)
+        return count
 
-    def num_tokens_from_list_string(self, list_of_string: List[str]) -> int:
-        num = 0
-        for s in list_of_string:
+    def num_tokens_from_strings(
+        self, list_of_string: List[str], num_threads: int = 8
+    ) -> List[int]:
+        """Token count of every string (0 for None), in one call.
+
+        Strings not in the memo are tokenized together by tiktoken's
+        multi-threaded batch encoder.
+        """
+        counts = [0] * len(list_of_string)
+        missing = []
+        for i, s in enumerate(list_of_string):
             if s is None:
                 continue
-            num += len(self.encoding.encode(s))
-        return num
+            key = _counts.key(s)
+            count = _counts.get(key)
+            if count is None:
+                missing.append((i, key))
+            else:
+                counts[i] = count
+        if missing:
+            encoded = self.encoding.encode_ordinary_batch(
+                [list_of_string[i] for i, _ in missing], num_threads=num_threads
+            )
+            for (i, key), ids in zip(missing, encoded):
+                counts[i] = len(ids)
+                _counts.put(key, counts[i])
+        return counts
+
+    def num_tokens_from_list_string(self, list_of_string: List[str]) -> int:
+        return sum(self.num_tokens_from_strings(list_of_string))
+
+    def cache_stats(self):
+        return _counts.stats()
 
     def compute_price(self, input_tokens, output_tokens, model):
         return (input_tokens / 1000) * self.model_price[model][0] + (
@@ -27,3 +176,31 @@ class tokenCounter:
     def text_truncation(self, text, max_len=1000):
         encoded_id = self.encoding.encode(text, disallowed_special=())
         return self.encoding.decode(encoded_id[: min(max_len, len(encoded_id))])
+
+
+class formatStripper:
+    """Incrementally remove `<format>` / `</format>` tags from a token stream."""
+
+    TAGS = ("<format>", "</format>")
+
+    def __init__(self) -> None:
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> str:
+        self.buffer += chunk
+        for tag in self.TAGS:
+            self.buffer = self.buffer.replace(tag, "")
+        # hold back a tail that may be the beginning of a tag split across chunks
+        keep = 0
+        for tag in self.TAGS:
+            for n in range(min(len(tag) - 1, len(self.buffer)), 0, -1):
+                if self.buffer.endswith(tag[:n]):
+                    keep = max(keep, n)
+                    break
+        text = self.buffer[: len(self.buffer) - keep]
+        self.buffer = self.buffer[len(self.buffer) - keep :]
+        return text
+
+    def flush(self) -> str:
+        text, self.buffer = self.buffer, ""
+        return text